@@ -1,32 +1,334 @@
 # app.py
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
 import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import simsimd
+from usearch.index import Index
 import os
 import json
+import functools
+import itertools
+from datetime import datetime
+import threading
+import queue
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from util import quantize_int8
+
+# ========= CONFIG =========
+VECTOR_DATABASE_PATH = 'vectors.pkl'
+# Split layout written by create_vectors.py: memory-mapped float16 embeddings + JSON metadata sidecar
+EMBEDDINGS_PATH = 'embeddings.npy'
+METADATA_PATH = 'metadata.json'
+# Optional int8 copy + per-vector scales written by create_vectors.py, used by the 'int8' precision
+INT8_EMBEDDINGS_PATH = 'embeddings.int8.npy'
+EMBEDDING_SCALES_PATH = 'embeddings.int8.scales.npy'
+# Precision of the corpus: 'float16' (memory-mapped, SimSIMD), 'int8' (quantized, SimSIMD) or 'float32' (BLAS)
+EMBEDDING_PRECISION = 'float16'
+# Threads SimSIMD splits each float16/int8 corpus scan across (0 = all cores)
+SCORE_THREADS = 0
+# Backend used to encode queries: 'onnx' (int8-quantized ONNX Runtime export) or 'torch' (default backend)
+QUERY_BACKEND = 'onnx'
+ONNX_MODEL_DIR = 'onnx_models'
+ONNX_MODEL_FILE = 'onnx/model_qint8_avx512_vnni.onnx'
+# Dynamic batching of concurrent query encodes
+ENCODE_BATCH_SIZE = 32
+ENCODE_BATCH_WAIT = 0.01  # seconds to wait for more queries before encoding a batch
+ENCODE_TIMEOUT = 10  # seconds a request waits for its embedding before the search fails with 503
+# Exact-match query embedding cache and semantic (near-duplicate) result cache
+QUERY_CACHE_SIZE = 4096
+SEMANTIC_CACHE_SIZE = 1024
+SEMANTIC_CACHE_THRESHOLD = 0.97
+# USearch HNSW index replaces the brute-force scan once the corpus is large enough
+USE_ANN_INDEX = True
+ANN_INDEX_PATH = 'vectors.usearch'
+ANN_MIN_VECTORS = 50000
+# ===========================
+
+class ORJSONProvider(JSONProvider):
+    """Serialize jsonify() responses with orjson; NumPy scalars and arrays are handled natively."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS),
+            mimetype='application/json'
+        )
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+def _cosine_scores(query_embedding, embeddings):
+    """Score a normalized float32 query against the corpus in whatever precision it is stored."""
+    if embeddings.dtype == np.int8:
+        query_i8, _ = quantize_int8(query_embedding[None, :])
+        distances = simsimd.cdist(query_i8, embeddings, metric="cosine", threads=SCORE_THREADS)
+        return 1.0 - np.asarray(distances).ravel()
+    if embeddings.dtype == np.float16:
+        distances = simsimd.cdist(query_embedding.astype(np.float16)[None, :], embeddings, metric="cosine",
+                                  threads=SCORE_THREADS)
+        return 1.0 - np.asarray(distances).ravel()
+    # float32 goes through BLAS, which is already multithreaded
+    return embeddings @ query_embedding
+
+def load_model(vector_database):
+    """
+    Load a backend-specialized copy of the vectorization model for query encoding.
+    
+    Called once at startup (and on reload only if the corpus was built with another model).
+    The int8 ONNX export is created on first use and persisted under ONNX_MODEL_DIR.
+    Static (Model2Vec) models are a token lookup with nothing to export, so they skip ONNX.
+    Falls back to the default backend if the export is not possible.
+    Databases written without a pickled model load it by model_name.
+    
+    Args:
+        vector_database (dict): Loaded vector database
+    
+    Returns:
+        SentenceTransformer: Model to encode queries with
+    """
+    model_name = vector_database.get('model_name')
+    model = vector_database.get('model')
+    if QUERY_BACKEND != 'onnx' or not model_name or vector_database.get('static_embeddings'):
+        return model if model is not None else SentenceTransformer(model_name)
+    
+    try:
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        
+        model_dir = os.path.join(ONNX_MODEL_DIR, model_name.replace('/', '_'))
+        if not os.path.exists(os.path.join(model_dir, ONNX_MODEL_FILE)):
+            print(f"Exporting '{model_name}' to quantized ONNX in '{model_dir}'...")
+            onnx_model = SentenceTransformer(model_name, backend='onnx')
+            onnx_model.save_pretrained(model_dir)
+            export_dynamic_quantized_onnx_model(onnx_model, 'avx512_vnni', model_dir)
+        
+        onnx_model = SentenceTransformer(model_dir, backend='onnx', model_kwargs={'file_name': ONNX_MODEL_FILE})
+        print(f"Using ONNX backend for query encoding ({ONNX_MODEL_FILE})")
+        return onnx_model
+    except Exception as e:
+        print(f"Warning: Could not load ONNX query model, using default backend: {str(e)}")
+        return model if model is not None else SentenceTransformer(model_name)
+
+# Queries waiting to be encoded, as (model, query, future) tuples
+_encode_queue = queue.Queue()
+
+def _encode_worker():
+    """Drain queued queries into batches and encode each batch with a single model call."""
+    while True:
+        batch = [_encode_queue.get()]
+        deadline = time.monotonic() + ENCODE_BATCH_WAIT
+        while len(batch) < ENCODE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_encode_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        # Group by model (a reload may swap it mid-batch) and sort by length to minimize padding
+        by_model = {}
+        for item in batch:
+            by_model.setdefault(id(item[0]), []).append(item)
+        
+        for items in by_model.values():
+            items.sort(key=lambda item: len(item[1]))
+            try:
+                embeddings = items[0][0].encode([query for _, query, _ in items],
+                                                batch_size=ENCODE_BATCH_SIZE,
+                                                convert_to_numpy=True)
+                for (_, _, future), embedding in zip(items, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+class EncodeUnavailableError(RuntimeError):
+    """The query encoder did not return an embedding in time (overloaded or its thread died)."""
+
+_encode_thread_lock = threading.Lock()
+_encode_thread = None
+
+def _ensure_encode_worker():
+    """Start the encoder thread, or restart it if it has died, so queued queries are never stranded."""
+    global _encode_thread
+    with _encode_thread_lock:
+        if _encode_thread is not None and _encode_thread.is_alive():
+            return
+        if _encode_thread is not None:
+            print("Warning: Query encoder thread died, restarting it")
+        _encode_thread = threading.Thread(target=_encode_worker, name='query-encoder', daemon=True)
+        _encode_thread.start()
+
+_ensure_encode_worker()
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _encode_query(model, query):
+    """Encode a query into a normalized, read-only float32 vector (cached per model and query)."""
+    _ensure_encode_worker()
+    future = Future()
+    _encode_queue.put((model, query, future))
+    try:
+        query_embedding = future.result(timeout=ENCODE_TIMEOUT).astype(np.float32)
+    except FutureTimeoutError:
+        print(f"Error: Query encoding timed out after {ENCODE_TIMEOUT}s ({_encode_queue.qsize()} queued)")
+        raise EncodeUnavailableError(f"Query encoding timed out after {ENCODE_TIMEOUT}s")
+    query_embedding /= np.linalg.norm(query_embedding) + 1e-12
+    query_embedding.setflags(write=False)
+    return query_embedding
+
+# Ring buffer of recent query embeddings and the results they produced
+_semantic_cache_lock = threading.Lock()
+_semantic_cache = {'embeddings': None, 'keys': [], 'results': [], 'next': 0}
+
+def _semantic_cache_lookup(query_embedding, key):
+    """Return cached results for a near-identical earlier query with the same key, if any."""
+    with _semantic_cache_lock:
+        count = len(_semantic_cache['results'])
+        if count == 0:
+            return None
+        distances = simsimd.cdist(query_embedding[None, :], _semantic_cache['embeddings'][:count], metric="cosine")
+        similarities = 1.0 - np.asarray(distances).ravel()
+        similarities[[cached_key != key for cached_key in _semantic_cache['keys']]] = -1.0
+        best = int(np.argmax(similarities))
+        if similarities[best] > SEMANTIC_CACHE_THRESHOLD:
+            return _semantic_cache['results'][best]
+    return None
+
+def _semantic_cache_store(query_embedding, key, results):
+    """Remember the results for a query, overwriting the oldest entry once the buffer is full."""
+    with _semantic_cache_lock:
+        if _semantic_cache['embeddings'] is None or _semantic_cache['embeddings'].shape[1] != query_embedding.shape[0]:
+            _semantic_cache['embeddings'] = np.zeros((SEMANTIC_CACHE_SIZE, query_embedding.shape[0]), dtype=np.float32)
+            _semantic_cache['keys'] = []
+            _semantic_cache['results'] = []
+            _semantic_cache['next'] = 0
+        slot = _semantic_cache['next']
+        _semantic_cache['embeddings'][slot] = query_embedding
+        if slot < len(_semantic_cache['results']):
+            _semantic_cache['keys'][slot] = key
+            _semantic_cache['results'][slot] = results
+        else:
+            _semantic_cache['keys'].append(key)
+            _semantic_cache['results'].append(results)
+        _semantic_cache['next'] = (slot + 1) % SEMANTIC_CACHE_SIZE
+
+def clear_query_cache():
+    """Drop all cached query embeddings and results (e.g. after the vectors are reloaded)."""
+    _encode_query.cache_clear()
+    with _semantic_cache_lock:
+        _semantic_cache['embeddings'] = None
+        _semantic_cache['keys'] = []
+        _semantic_cache['results'] = []
+        _semantic_cache['next'] = 0
+
+# Generation number stamped on each loaded corpus, so cached results are tied to the corpus they index
+_corpus_generations = itertools.count()
+
+def load_ann_index(embeddings, source_path, index_path=ANN_INDEX_PATH):
+    """
+    Load the persisted HNSW index (memory-mapped) or build and save a new one.
+    
+    The saved index is reused only if it is newer than the vector database and
+    matches the corpus shape.
+    
+    Args:
+        embeddings (np.ndarray): Normalized float32 corpus embeddings
+        source_path (str): Path of the vector database the embeddings came from
+        index_path (str): Path of the persisted index
+    
+    Returns:
+        Index: USearch index keyed by row number
+    """
+    ndim = embeddings.shape[1]
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(source_path):
+        try:
+            index = Index.restore(index_path, view=True)
+            if index is not None and index.ndim == ndim and len(index) == len(embeddings):
+                print(f"Loaded ANN index from '{index_path}'")
+                return index
+        except Exception as e:
+            print(f"Warning: Could not load ANN index, rebuilding: {str(e)}")
+    
+    print(f"Building ANN index over {len(embeddings)} embeddings...")
+    index = Index(ndim=ndim, metric='cos', dtype='f16')
+    index.add(np.arange(len(embeddings)), embeddings)
+    # Renamed into place: an index still being served may have the old file memory-mapped (view=True),
+    # and overwriting it in place would truncate that mapping
+    index.save(index_path + '.tmp')
+    os.replace(index_path + '.tmp', index_path)
+    return index
 
 # Load vector database
-def load_vector_database(file_path='vectors.pkl'):
+def load_corpus(file_path=VECTOR_DATABASE_PATH):
     """
-    Load the vector database from pickle file.
+    Load the embeddings and message metadata of the vector database.
+    
+    The split layout (EMBEDDINGS_PATH + METADATA_PATH) is preferred when present,
+    since the float16 embeddings can be memory-mapped instead of unpickled.
+    The query model is loaded separately by load_model so reloads do not re-create it.
     
     Args:
-        file_path (str): Path to the pickle file containing vectors
+        file_path (str): Path to the legacy pickle file containing vectors
     
     Returns:
-        dict: Vector database with embeddings, metadata, and model
+        dict: Vector database with embeddings, metadata, and lookup indexes
     """
-    if not os.path.exists(file_path):
+    split_layout = os.path.exists(EMBEDDINGS_PATH) and os.path.exists(METADATA_PATH)
+    if split_layout and os.path.exists(file_path) and os.path.getmtime(file_path) > os.path.getmtime(EMBEDDINGS_PATH):
+        print(f"Warning: '{file_path}' is newer than '{EMBEDDINGS_PATH}', loading the pickle (re-run migrate_vectors.py)")
+        split_layout = False
+    if not split_layout and not os.path.exists(file_path):
         print(f"Error: Vector database file '{file_path}' not found.")
         return None
     
     try:
-        with open(file_path, 'rb') as f:
-            vector_database = pickle.load(f)
+        if split_layout:
+            with open(METADATA_PATH, 'rb') as f:
+                vector_database = orjson.loads(f.read())
+            vector_database['embeddings'] = np.load(EMBEDDINGS_PATH, mmap_mode='r')
+            source_path = EMBEDDINGS_PATH
+        else:
+            with open(file_path, 'rb') as f:
+                vector_database = pickle.load(f)
+            source_path = file_path
+        
+        embeddings = vector_database['embeddings']
+        # Use the pre-quantized int8 files when they were written alongside the current embeddings
+        int8_layout = (EMBEDDING_PRECISION == 'int8' and split_layout
+                       and os.path.exists(INT8_EMBEDDINGS_PATH) and os.path.exists(EMBEDDING_SCALES_PATH)
+                       and os.path.getmtime(INT8_EMBEDDINGS_PATH) >= os.path.getmtime(EMBEDDINGS_PATH))
+        if embeddings.ndim == 2 and len(embeddings) > 0:
+            # A float16 file was normalized when it was written and is scanned straight off the mapping;
+            # anything else is normalized once as contiguous float32 so cosine similarity is a dot product
+            if not ((EMBEDDING_PRECISION == 'float16' or int8_layout) and embeddings.dtype == np.float16):
+                embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+            if USE_ANN_INDEX and len(embeddings) >= ANN_MIN_VECTORS:
+                vector_database['ann_index'] = load_ann_index(embeddings, source_path)
+            if int8_layout:
+                embeddings = np.load(INT8_EMBEDDINGS_PATH, mmap_mode='r')
+                vector_database['embedding_scales'] = np.load(EMBEDDING_SCALES_PATH, mmap_mode='r')
+            elif EMBEDDING_PRECISION == 'int8':
+                # Quantize once so every scan moves a quarter of the bytes
+                embeddings, vector_database['embedding_scales'] = quantize_int8(embeddings)
+            elif EMBEDDING_PRECISION == 'float16' and embeddings.dtype != np.float16:
+                embeddings = embeddings.astype(np.float16)
+        vector_database['embeddings'] = embeddings
+        vector_database['filter_index'] = build_filter_index(vector_database['message_metadata'])
+        vector_database['chunk_index'] = build_chunk_index(vector_database['message_metadata'])
+        vector_database['formatted'] = [format_result(metadata) for metadata in vector_database['message_metadata']]
+        vector_database['generation'] = next(_corpus_generations)
         
         print(f"Loaded vector database with {len(vector_database['embeddings'])} embeddings")
         return vector_database
@@ -34,163 +336,293 @@ def load_vector_database(file_path='vectors.pkl'):
         print(f"Error loading vector database: {str(e)}")
         return None
 
+def build_chunk_index(message_metadata):
+    """
+    Map each chunk_id to the index of its first message so /context is a dict lookup.
+    
+    Args:
+        message_metadata (list): Metadata entries from the vector database
+    
+    Returns:
+        dict: chunk_id -> index into message_metadata
+    """
+    chunk_index = {}
+    for idx, metadata in enumerate(message_metadata):
+        chunk_id = metadata.get('chunk_id')
+        if chunk_id:
+            chunk_index.setdefault(chunk_id, idx)
+    return chunk_index
+
+def _metadata_content(metadata):
+    """Message text of a metadata entry (older databases keep it under 'original_message')."""
+    if 'content' in metadata:
+        return metadata['content']
+    return metadata.get('original_message', {}).get('content', '')
+
+def format_result(metadata):
+    """
+    Build the /search response fields for one message; score and content are filled per request.
+    
+    Args:
+        metadata (dict): Metadata entry from the vector database
+    
+    Returns:
+        dict: Result template for the message
+    """
+    formatted_result = {
+        'score': None,
+        'content': None,
+        'username': metadata.get('username', 'Unknown'),
+        'timestamp': metadata.get('timestamp', 'Unknown'),
+        'source_type': 'discord' if 'discord_info' in metadata else 'markdown'
+    }
+    
+    # Only include source_file and line_number if they're valid (not None)
+    if 'source_file' in metadata and 'line_number' in metadata and metadata.get('line_number') is not None:
+        formatted_result['source_file'] = metadata.get('source_file')
+        formatted_result['line_number'] = metadata.get('line_number')
+    
+    # For markdown chunks, include chunk_id for context retrieval
+    if 'chunk_id' in metadata:
+        formatted_result['chunk_id'] = metadata.get('chunk_id')
+    
+    # Add Discord link information if available
+    if 'discord_info' in metadata:
+        discord_info = metadata['discord_info']
+        formatted_result['discord_link'] = f"https://discord.com/channels/{discord_info['guild_id']}/{discord_info['channel_id']}/{discord_info['message_id']}"
+        formatted_result['channel_id'] = discord_info['channel_id']
+    
+    # Add markdown file information if available
+    if 'file_path' in metadata:
+        formatted_result['file_path'] = metadata['file_path']
+        formatted_result['chunk_id'] = metadata.get('chunk_id', '')
+        formatted_result['chunk_index'] = metadata.get('chunk_index', 0)
+    
+    return formatted_result
+
+@functools.lru_cache(maxsize=64)
+def _read_lines(path, mtime):
+    """Read a source file's lines, cached per (path, mtime) so edits invalidate the entry."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.readlines()
+
 # Search vectors function
-def search_vectors(query, vector_database, top_k=10):
+def search_vectors(query, model, vector_database, top_k=10, filters=None):
     """
     Search for similar vectors to the query.
     
     Args:
         query (str): Search query
+        model (SentenceTransformer): Model to encode the query with
         vector_database (dict): Loaded vector database
         top_k (int): Number of top results to return
+        filters (dict): Optional filter parameters (year, channel, source_type)
+                        applied before scoring
     
     Returns:
         list: Top k similar messages with scores
+    
+    Raises:
+        EncodeUnavailableError: If the query could not be encoded in time
     """
     try:
-        # Load the model used for vectorization
-        model = vector_database['model']
+        # Create a normalized embedding for the query (whitespace-normalized for caching)
+        query_embedding = _encode_query(model, ' '.join(query.split()))
         
-        # Create embedding for the query
-        query_embedding = model.encode([query])
-        
-        # Get all embeddings
+        # Get all embeddings (already normalized at load time)
         embeddings = vector_database['embeddings']
         
         if len(embeddings) == 0:
             print("No embeddings found in database")
             return []
         
-        # Calculate cosine similarities
-        similarities = cosine_similarity(query_embedding, embeddings)[0]
+        # Reuse results from a near-duplicate recent query on this same corpus (a search still running
+        # on the previous corpus after a reload stores under its own generation, which nothing looks up)
+        filters_key = _filters_key(filters)
+        cache_key = (vector_database.get('generation'), top_k, filters_key)
+        cached_results = _semantic_cache_lookup(query_embedding, cache_key)
+        if cached_results is not None:
+            return cached_results
+        
+        # Restrict the candidate set to records matching the filters before scoring
+        candidate_indices = None
+        if filters_key:
+            mask = build_filter_mask(filters, vector_database['filter_index'])
+            candidate_indices = np.flatnonzero(mask)
         
-        # Get top k indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        candidate_count = len(embeddings) if candidate_indices is None else len(candidate_indices)
+        k = min(top_k, candidate_count)
+        if k <= 0:
+            return []
+        
+        if 'ann_index' in vector_database and candidate_indices is None:
+            # Walk the HNSW graph instead of scanning every embedding
+            matches = vector_database['ann_index'].search(query_embedding, k)
+            top_indices = matches.keys[:len(matches)].astype(np.int64)
+            top_scores = 1.0 - matches.distances[:len(matches)]
+        else:
+            # Calculate cosine similarities over the candidates only
+            if candidate_indices is None:
+                similarities = _cosine_scores(query_embedding, embeddings)
+            else:
+                similarities = _cosine_scores(query_embedding, embeddings[candidate_indices])
+            
+            # Get top k indices (partial selection, then sort only the k winners)
+            local_indices = np.argpartition(similarities, -k)[-k:]
+            local_indices = local_indices[np.argsort(similarities[local_indices])[::-1]]
+            top_scores = similarities[local_indices]
+            if candidate_indices is None:
+                top_indices = local_indices
+            else:
+                top_indices = candidate_indices[local_indices]
         
         # Get top k results with scores
         results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Only include results with some similarity
+        for idx, score in zip(top_indices, top_scores):
+            if score > 0:  # Only include results with some similarity
                 results.append({
-                    'score': float(similarities[idx]),  # Convert to Python float
+                    'index': int(idx),
+                    'score': float(score),  # Convert to Python float
                     'metadata': vector_database['message_metadata'][idx],
-                    'content': vector_database['message_metadata'][idx]['original_message']['content']
+                    'content': _metadata_content(vector_database['message_metadata'][idx])
                 })
         
+        _semantic_cache_store(query_embedding, cache_key, results)
         return results
+    except EncodeUnavailableError:
+        # Not the same as "no matches", so let the endpoint report it
+        raise
     except Exception as e:
         print(f"Error in search_vectors: {str(e)}")
         return []
 
-def get_available_filters(vector_database):
+# Bit flags stored per record in the filter index
+SOURCE_DISCORD = 1
+SOURCE_MARKDOWN = 2
+
+def _parse_year(timestamp):
+    """Extract the year from a metadata timestamp, or None if it can't be parsed."""
+    try:
+        if isinstance(timestamp, str):
+            ts = datetime.fromisoformat(timestamp.replace(' UTC', '+00:00'))
+        else:
+            ts = timestamp
+        return ts.year
+    except:
+        return None
+
+def build_filter_index(message_metadata):
     """
-    Extract available filter options from the vector database.
+    Precompute per-record filter columns and the available filter options.
+    
+    Args:
+        message_metadata (list): Metadata records of the vector database
     
     Returns:
-        dict: Dictionary with years, channels, and source types
+        dict: NumPy columns indexed like the embeddings (year, channel code, source flags),
+              the channel code lookup, and the available filter options
     """
-    from datetime import datetime
+    count = len(message_metadata)
+    year_by_idx = np.zeros(count, dtype=np.int16)  # 0 = unknown
+    channel_by_idx = np.full(count, -1, dtype=np.int32)  # -1 = no channel
+    source_flags_by_idx = np.zeros(count, dtype=np.uint8)
     
+    channel_codes = {}
     years = set()
-    channels = set()
     source_types = set()
     
-    for metadata in vector_database['message_metadata']:
+    for idx, metadata in enumerate(message_metadata):
         # Extract year from timestamp
         if metadata.get('timestamp'):
-            try:
-                if isinstance(metadata['timestamp'], str):
-                    ts = datetime.fromisoformat(metadata['timestamp'].replace(' UTC', '+00:00'))
-                else:
-                    ts = metadata['timestamp']
-                years.add(ts.year)
-            except:
-                pass
+            year = _parse_year(metadata['timestamp'])
+            if year is not None:
+                year_by_idx[idx] = year
+                years.add(year)
         
         # Extract channel from discord_info
         if 'discord_info' in metadata:
+            source_flags_by_idx[idx] |= SOURCE_DISCORD
             try:
-                channel_id = metadata['discord_info'].get('channel_id', 'Unknown')
-                channels.add(str(channel_id))
+                channel_id = str(metadata['discord_info'].get('channel_id', 'Unknown'))
+                channel_by_idx[idx] = channel_codes.setdefault(channel_id, len(channel_codes))
             except:
                 pass
         
         # Determine source type
         if 'file_path' in metadata:
+            source_flags_by_idx[idx] |= SOURCE_MARKDOWN
             source_types.add('markdown')
         elif 'discord_info' in metadata:
             source_types.add('discord')
     
     return {
-        'years': sorted(list(years), reverse=True),
-        'channels': sorted(list(channels)),
-        'source_types': sorted(list(source_types))
+        'year_by_idx': year_by_idx,
+        'channel_by_idx': channel_by_idx,
+        'source_flags_by_idx': source_flags_by_idx,
+        'channel_codes': channel_codes,
+        'available': {
+            'years': sorted(years, reverse=True),
+            'channels': sorted(channel_codes),
+            'source_types': sorted(source_types)
+        }
     }
 
-def filter_results(results, filters):
+def get_available_filters(vector_database):
     """
-    Filter search results based on selected filters.
+    Get the available filter options computed when the vector database was loaded.
+    
+    Returns:
+        dict: Dictionary with years, channels, and source types
+    """
+    return vector_database['filter_index']['available']
+
+def _filters_key(filters):
+    """Hashable form of the active filters (empty tuple when nothing is filtered)."""
+    if not filters:
+        return ()
+    return tuple((name, str(filters[name])) for name in ('year', 'channel', 'source_type') if filters.get(name))
+
+def build_filter_mask(filters, filter_index):
+    """
+    Build a boolean mask of the records that match the selected filters.
     
     Args:
-        results (list): List of search results
         filters (dict): Dictionary with filter parameters (year, channel, source_type)
+        filter_index (dict): Filter columns from build_filter_index
     
     Returns:
-        list: Filtered results
+        np.ndarray: Boolean mask over the whole corpus
     """
-    from datetime import datetime
-    
-    filtered = results
+    mask = np.ones(len(filter_index['year_by_idx']), dtype=bool)
     
     # Filter by year
     if filters.get('year'):
         year = int(filters['year'])
-        filtered = [r for r in filtered if _get_year_from_result(r) == year]
+        mask &= filter_index['year_by_idx'] == year
     
     # Filter by channel
     if filters.get('channel'):
-        channel = str(filters['channel'])
-        filtered = [r for r in filtered if _get_channel_from_result(r) == channel]
+        channel_code = filter_index['channel_codes'].get(str(filters['channel']), -2)  # -2 matches nothing
+        mask &= filter_index['channel_by_idx'] == channel_code
     
     # Filter by source type
     if filters.get('source_type'):
         source_type = filters['source_type']
         if source_type == 'discord':
-            filtered = [r for r in filtered if 'discord_info' in r.get('metadata', {})]
+            mask &= (filter_index['source_flags_by_idx'] & SOURCE_DISCORD) != 0
         elif source_type == 'markdown':
-            filtered = [r for r in filtered if 'file_path' in r.get('metadata', {})]
+            mask &= (filter_index['source_flags_by_idx'] & SOURCE_MARKDOWN) != 0
     
-    return filtered
-
-def _get_year_from_result(result):
-    """Extract year from a search result."""
-    from datetime import datetime
-    try:
-        metadata = result.get('metadata', {})
-        timestamp = metadata.get('timestamp')
-        if isinstance(timestamp, str):
-            ts = datetime.fromisoformat(timestamp.replace(' UTC', '+00:00'))
-        else:
-            ts = timestamp
-        return ts.year
-    except:
-        return None
-
-def _get_channel_from_result(result):
-    """Extract channel from a search result."""
-    try:
-        metadata = result.get('metadata', {})
-        if 'discord_info' in metadata:
-            return str(metadata['discord_info'].get('channel_id', 'Unknown'))
-    except:
-        pass
-    return None
+    return mask
 
 # Load database once at startup
 print("Loading vector database...")
-vector_database = load_vector_database('vectors.pkl')
+vector_database = load_corpus(VECTOR_DATABASE_PATH)
+query_model = None
 if vector_database is None:
     print("Warning: Vector database not loaded. Search functionality will be limited.")
+else:
+    query_model = load_model(vector_database)
 
 @app.route('/')
 def index():
@@ -216,6 +648,31 @@ def status():
         'embedding_count': len(vector_database['embeddings'])
     })
 
+@app.route('/reload_vectors', methods=['POST'])
+def reload_vectors():
+    """
+    Reload the vector database from disk and drop cached query results.
+    
+    Only the corpus is swapped; the query model is kept unless the new
+    corpus was built with a different model.
+    
+    Returns:
+        dict: Reload status
+    """
+    global vector_database, query_model
+    
+    new_database = load_corpus(VECTOR_DATABASE_PATH)
+    if new_database is None:
+        return jsonify({'error': 'Failed to reload vector database'}), 500
+    
+    if query_model is None or vector_database is None or new_database.get('model_name') != vector_database.get('model_name'):
+        query_model = load_model(new_database)
+    vector_database = new_database
+    clear_query_cache()
+    return jsonify({
+        'message': f"Reloaded vector database with {len(vector_database['embeddings'])} embeddings"
+    })
+
 @app.route('/search', methods=['POST'])
 def search():
     print("Search endpoint called")
@@ -242,51 +699,24 @@ def search():
             return jsonify({'error': 'No query provided'}), 400
         
         print(f"Searching for query: {query}")
-        results = search_vectors(query, vector_database, top_k)
-        
-        # Apply filters
         if filters:
             print(f"Applying filters: {filters}")
-            results = filter_results(results, filters)
+        database = vector_database
+        results = search_vectors(query, query_model, database, top_k, filters)
         
-        # Format results for JSON response
+        # Format results for JSON response from the templates built at load time
         formatted_results = []
         for result in results:
-            metadata = result['metadata']
-            formatted_result = {
-                'score': result['score'],
-                'content': result['content'],
-                'username': metadata.get('username', 'Unknown'),
-                'timestamp': metadata.get('timestamp', 'Unknown'),
-                'source_type': 'discord' if 'discord_info' in metadata else 'markdown'
-            }
-            
-            # Only include source_file and line_number if they're valid (not None)
-            if 'source_file' in metadata and 'line_number' in metadata and metadata.get('line_number') is not None:
-                formatted_result['source_file'] = metadata.get('source_file')
-                formatted_result['line_number'] = metadata.get('line_number')
-            
-            # For markdown chunks, include chunk_id for context retrieval
-            if 'chunk_id' in metadata:
-                formatted_result['chunk_id'] = metadata.get('chunk_id')
-            
-            # Add Discord link information if available
-            if 'discord_info' in metadata:
-                discord_info = metadata['discord_info']
-                formatted_result['discord_link'] = f"https://discord.com/channels/{discord_info['guild_id']}/{discord_info['channel_id']}/{discord_info['message_id']}"
-                formatted_result['channel_id'] = discord_info['channel_id']
-            
-            # Add markdown file information if available
-            if 'file_path' in metadata:
-                formatted_result['file_path'] = metadata['file_path']
-                formatted_result['chunk_id'] = metadata.get('chunk_id', '')
-                formatted_result['chunk_index'] = metadata.get('chunk_index', 0)
-            
+            formatted_result = database['formatted'][result['index']].copy()
+            formatted_result['score'] = result['score']
+            formatted_result['content'] = result['content']
             formatted_results.append(formatted_result)
         
         print(f"Found {len(formatted_results)} results")
         return jsonify({'results': formatted_results})
         
+    except EncodeUnavailableError as e:
+        return jsonify({'error': f'Search unavailable: {str(e)}'}), 503
     except Exception as e:
         print(f"Error in search endpoint: {str(e)}")
         return jsonify({'error': f'Search error: {str(e)}'}), 500
@@ -327,16 +757,17 @@ def get_context():
         # Handle markdown chunks
         if chunk_id:
             # Find the chunk in the vector database
-            for idx, metadata in enumerate(vector_database['message_metadata']):
-                if metadata.get('chunk_id') == chunk_id:
-                    # Return the chunk content directly
-                    return jsonify({
-                        'chunk_id': chunk_id,
-                        'content': metadata['original_message'].get('content', ''),
-                        'file_path': metadata.get('file_path', ''),
-                        'context_type': 'markdown_chunk'
-                    })
-            return jsonify({'error': f'Chunk not found: {chunk_id}'}), 404
+            idx = vector_database['chunk_index'].get(chunk_id)
+            if idx is None:
+                return jsonify({'error': f'Chunk not found: {chunk_id}'}), 404
+            metadata = vector_database['message_metadata'][idx]
+            # Return the chunk content directly
+            return jsonify({
+                'chunk_id': chunk_id,
+                'content': _metadata_content(metadata),
+                'file_path': metadata.get('file_path', ''),
+                'context_type': 'markdown_chunk'
+            })
         
         # Handle Discord messages (original behavior)
         if line_number_raw in [None, 'null', 'None', '']:
@@ -357,8 +788,7 @@ def get_context():
             return jsonify({'error': f'Source file not found: {full_path}'}), 404
         
         try:
-            with open(full_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            lines = _read_lines(full_path, os.path.getmtime(full_path))
             
             # Calculate start and end line numbers
             start_line = max(0, line_number - context_lines - 1)
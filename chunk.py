@@ -4,18 +4,24 @@ Unified Chunking Script
 Processes Discord text exports and Markdown files for vector embedding
 """
 
-import json
+import orjson
 import os
 import re
+import glob
 import sys
-import hashlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from util import get_file_hashes, load_cache, save_cache
 
 # ============================================================================
 # DISCORD CHUNKING FUNCTIONS
 # ============================================================================
 
+# Anchored message prefix "[YYYY-MM-DD HH:MM:SS UTC] "; the rest is split as "username: content"
+_TIMESTAMP_PREFIX_RE = re.compile(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) UTC\] ')
+
 def parse_timestamp(timestamp_str):
     """
     Parse timestamp string into datetime object.
@@ -26,9 +32,11 @@ def parse_timestamp(timestamp_str):
     Returns:
         datetime: Parsed datetime object
     """
-    # Remove brackets and parse
+    # Remove brackets and the UTC suffix; the remaining ISO form parses on the fast C path
     timestamp_str = timestamp_str.strip('[]')
-    return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S UTC')
+    if timestamp_str.endswith(' UTC'):
+        timestamp_str = timestamp_str[:-4]
+    return datetime.fromisoformat(timestamp_str)
 
 def chunk_lines_to_json(input_file_path, output_file_path=None):
     """
@@ -47,58 +55,11 @@ def chunk_lines_to_json(input_file_path, output_file_path=None):
     metadata_map = {}
     if os.path.exists(metadata_path):
         try:
-            with open(metadata_path, 'r', encoding='utf-8') as mf:
-                metadata_map = json.load(mf)
+            with open(metadata_path, 'rb') as mf:
+                metadata_map = orjson.loads(mf.read())
         except Exception as e:
             print(f"Warning: Could not load metadata from {metadata_path}: {e}")
     
-    # Read all lines from the input file
-    with open(input_file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-    
-    # Parse messages with timestamps
-    messages = []
-    for line_num, line in enumerate(lines, 1):
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Match timestamp pattern [YYYY-MM-DD HH:MM:SS UTC] username: message content
-        # Updated to handle usernames with special characters like #
-        timestamp_pattern = r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC)\] (.*?): (.*)'
-        match = re.match(timestamp_pattern, line)
-        
-        if match:
-            timestamp_str, username, content = match.groups()
-            try:
-                timestamp = parse_timestamp(timestamp_str)
-                message_obj = {
-                    "line_number": line_num,
-                    "timestamp": timestamp,
-                    "username": username,
-                    "content": content,
-                    "source_file": filename
-                }
-                # Add Discord IDs if available in metadata
-                if str(line_num) in metadata_map:
-                    message_obj["discord_info"] = metadata_map[str(line_num)]
-                messages.append(message_obj)
-            except ValueError as e:
-                print(f"Warning: Could not parse timestamp in line {line_num}: {e}")
-        else:
-            # If line doesn't match timestamp pattern, treat as a standalone message
-            message_obj = {
-                "line_number": line_num,
-                "timestamp": None,
-                "username": None,
-                "content": line,
-                "source_file": filename
-            }
-            # Add Discord IDs if available in metadata
-            if str(line_num) in metadata_map:
-                message_obj["discord_info"] = metadata_map[str(line_num)]
-            messages.append(message_obj)
-    
     # Determine output file path if not provided
     if output_file_path is None:
         # Create output filename based on input filename
@@ -112,11 +73,64 @@ def chunk_lines_to_json(input_file_path, output_file_path=None):
     # Full path for the output file
     full_output_path = os.path.join(output_dir, output_file_path)
     
-    # Write to JSON file
-    with open(full_output_path, 'w', encoding='utf-8') as json_file:
-        json.dump(messages, json_file, indent=2, ensure_ascii=False, default=str)
+    # Stream lines from the input file and write each message as soon as it is parsed.
+    # The array is written to a temporary file so a failed run never leaves a truncated output.
+    message_count = 0
+    temp_output_path = full_output_path + '.tmp'
+    with open(input_file_path, 'r', encoding='utf-8') as file, open(temp_output_path, 'wb') as json_file:
+        json_file.write(b'[\n')
+        
+        for line_num, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+                
+            # Match timestamp pattern [YYYY-MM-DD HH:MM:SS UTC] username: message content
+            # Usernames may contain special characters like #, so split on the first ": "
+            match = _TIMESTAMP_PREFIX_RE.match(line)
+            if match:
+                username, separator, content = line[match.end():].partition(': ')
+                if not separator:
+                    match = None
+            
+            if match:
+                timestamp_str = match.group(1)
+                try:
+                    timestamp = parse_timestamp(timestamp_str)
+                except ValueError as e:
+                    print(f"Warning: Could not parse timestamp in line {line_num}: {e}")
+                    continue
+                message_obj = {
+                    "line_number": line_num,
+                    # Same "YYYY-MM-DD HH:MM:SS" form str(datetime) produced before
+                    "timestamp": timestamp.isoformat(sep=' '),
+                    "username": username,
+                    "content": content,
+                    "source_file": filename
+                }
+            else:
+                # If line doesn't match timestamp pattern, treat as a standalone message
+                message_obj = {
+                    "line_number": line_num,
+                    "timestamp": None,
+                    "username": None,
+                    "content": line,
+                    "source_file": filename
+                }
+            
+            # Add Discord IDs if available in metadata
+            if str(line_num) in metadata_map:
+                message_obj["discord_info"] = metadata_map[str(line_num)]
+            
+            if message_count:
+                json_file.write(b',\n')
+            json_file.write(b'  ' + orjson.dumps(message_obj))
+            message_count += 1
+        
+        json_file.write(b'\n]\n')
+    os.replace(temp_output_path, full_output_path)
     
-    print(f"Successfully processed {len(messages)} messages from '{filename}'")
+    print(f"Successfully processed {message_count} messages from '{filename}'")
     print(f"Output saved to '{full_output_path}'")
 
 def process_discord_directory(directory_path):
@@ -154,17 +168,74 @@ def process_discord_directory(directory_path):
 # MARKDOWN CHUNKING FUNCTIONS
 # ============================================================================
 
-def get_file_hash(filepath):
-    """Calculate MD5 hash of a file's content."""
-    hash_md5 = hashlib.md5()
-    try:
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except Exception as e:
-        print(f"Error calculating hash for {filepath}: {e}")
-        return None
+def _write_chunks(md_file, rel_path, source_stem, output_path):
+    """
+    Chunk one markdown file and stream its chunks to output_path as JSON Lines.
+    
+    Lines go to a temporary file as chunk_markdown_file yields them, renamed into place when done;
+    nothing is written for a file without content.
+    
+    Args:
+        md_file (str): Path to the markdown file
+        rel_path (str): Path of the file relative to the input directory
+        source_stem (str): Unique stem used for the chunk ids
+        output_path (str): Path of the .jsonl file to write
+    
+    Returns:
+        int: Number of chunks written
+    """
+    chunk_count = 0
+    temp_output_path = output_path + '.tmp'
+    with open(temp_output_path, 'wb') as f:
+        for chunk in chunk_markdown_file(md_file):
+            chunk_id = f"{source_stem}_chunk_{chunk['chunk_index']}"
+            chunk_data = {
+                'chunk_id': chunk_id,
+                'chunk_index': chunk['chunk_index'],
+                'content': chunk['content'],
+                'source_file': rel_path,
+                'metadata': {
+                    'file_name': Path(md_file).name,
+                    'file_path': rel_path,
+                    'chunk_id': chunk_id,
+                    'chunk_index': chunk['chunk_index'],
+                    'char_count': chunk['char_count'],
+                    'source_type': 'markdown'
+                }
+            }
+            f.write(orjson.dumps(chunk_data))
+            f.write(b"\n")
+            chunk_count += 1
+    if chunk_count:
+        os.replace(temp_output_path, output_path)
+    else:
+        os.remove(temp_output_path)
+    return chunk_count
+
+def _source_stem(rel_path):
+    """Flatten a source's relative path (without extension) into a unique output file stem."""
+    return os.path.splitext(rel_path)[0].replace(os.sep, '__').replace('/', '__')
+
+def _remove_legacy_chunks(output_dir, file_stem, rel_path):
+    """
+    Remove the per-chunk JSON files an older run wrote for one source.
+    
+    Those were named by the bare file stem, so sources with the same name in different
+    folders share the pattern; only files whose source_file is this source are removed.
+    
+    Args:
+        output_dir (str): Directory holding the chunk files
+        file_stem (str): File name of the source without extension
+        rel_path (str): Path of the source relative to the input directory
+    """
+    for old_chunk_file in glob.glob(os.path.join(glob.escape(output_dir), f"{glob.escape(file_stem)}_chunk_*.json")):
+        try:
+            with open(old_chunk_file, 'rb') as f:
+                if orjson.loads(f.read()).get('source_file') != rel_path:
+                    continue
+            os.remove(old_chunk_file)
+        except (OSError, orjson.JSONDecodeError, AttributeError) as e:
+            print(f"  Warning: Could not check old chunk file {old_chunk_file}: {e}")
 
 def chunk_markdown_file(file_path, chunk_size=1000, overlap=100):
     """
@@ -175,79 +246,83 @@ def chunk_markdown_file(file_path, chunk_size=1000, overlap=100):
         chunk_size (int): Target number of characters per chunk
         overlap (int): Number of characters to overlap between chunks
     
-    Returns:
-        list: List of chunk dictionaries
+    Yields:
+        dict: Chunk dictionaries, in order
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        # Decode straight from a read-only mapping instead of buffering the file first
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                content = ''
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    content = str(mm, 'utf-8')
+        # Match text-mode newline handling
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
-        return []
+        return
     
-    chunks = []
     chunk_index = 0
     
-    # Split by paragraphs first
+    # Split by paragraphs first; the current chunk is always the slice content[start:end]
     paragraphs = content.split('\n\n')
-    current_chunk = ""
+    start = end = 0
+    para_start = 0
     
     for para in paragraphs:
-        # Add paragraph to current chunk
-        test_chunk = current_chunk + "\n\n" + para if current_chunk else para
+        para_end = para_start + len(para)
+        
+        # Adding this paragraph extends the current chunk through the paragraph end
+        if end > start:
+            test_start = start
+        else:
+            test_start = para_start
         
         # If adding this paragraph exceeds chunk size, save current chunk and start new one
-        if len(test_chunk) > chunk_size and current_chunk:
-            chunks.append({
+        if para_end - test_start > chunk_size and end > start:
+            yield {
                 'chunk_index': chunk_index,
-                'content': current_chunk.strip(),
-                'char_count': len(current_chunk)
-            })
+                'content': content[start:end].strip(),
+                'char_count': end - start
+            }
             chunk_index += 1
             
-            # Start new chunk with overlap from previous chunk
-            overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
-            current_chunk = overlap_text + "\n\n" + para
+            # Start new chunk with overlap from previous chunk (overlap=0 keeps the whole chunk)
+            if overlap > 0 and end - start > overlap:
+                start = end - overlap
         else:
-            current_chunk = test_chunk
+            start = test_start
+        end = para_end
+        para_start = para_end + 2
     
     # Add final chunk
-    if current_chunk.strip():
-        chunks.append({
+    final_chunk = content[start:end]
+    if final_chunk.strip():
+        yield {
             'chunk_index': chunk_index,
-            'content': current_chunk.strip(),
-            'char_count': len(current_chunk)
-        })
-    
-    return chunks
+            'content': final_chunk.strip(),
+            'char_count': end - start
+        }
 
 def process_markdown_files(input_dir, output_dir='chunked_markdown', cache_file='chunk_cache.json'):
     """
-    Process all markdown files in a directory and save chunks as JSON.
+    Process all markdown files in a directory and save chunks as JSON Lines (one file per source).
     
     Args:
         input_dir (str): Directory containing markdown files
-        output_dir (str): Directory to save chunked JSON files
+        output_dir (str): Directory to save chunked JSONL files
         cache_file (str): Cache file for tracking processed files
     """
     # Ensure output directory exists
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     
     # Load or create cache
-    cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                cache = json.load(f)
-        except Exception as e:
-            print(f"Warning: Could not load cache: {e}")
+    cache = load_cache(cache_file)
     
     # Find all markdown files
-    markdown_files = []
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.md'):
-                markdown_files.append(os.path.join(root, file))
+    markdown_files = [str(path) for path in Path(input_dir).rglob('*.md') if path.is_file()]
     
     if not markdown_files:
         print(f"No markdown files found in '{input_dir}'")
@@ -258,73 +333,88 @@ def process_markdown_files(input_dir, output_dir='chunked_markdown', cache_file=
     processed_count = 0
     skipped_count = 0
     
+    # Files whose size and mtime match the cache are unchanged; only the rest are read and hashed
+    file_stats = {}
+    files_to_hash = []
     for md_file in markdown_files:
-        # Calculate file hash
-        current_hash = get_file_hash(md_file)
-        if current_hash is None:
-            continue
-        
-        # Check if file has been processed and hasn't changed
-        file_key = os.path.relpath(md_file, input_dir)
-        if file_key in cache and cache[file_key] == current_hash:
-            print(f"Skipping '{file_key}' (no changes)")
-            skipped_count += 1
-            continue
-        
-        # Process the file
-        print(f"Processing '{file_key}'")
-        chunks = chunk_markdown_file(md_file)
-        
-        if not chunks:
-            print(f"  No content to chunk in '{file_key}'")
+        try:
+            stat = os.stat(md_file)
+        except OSError as e:
+            print(f"Error reading {md_file}: {e}")
             continue
+        file_stats[md_file] = (stat.st_size, stat.st_mtime_ns)
+        entry = cache.get(os.path.relpath(md_file, input_dir))
+        if not (isinstance(entry, dict) and (entry.get('size'), entry.get('mtime')) == file_stats[md_file]):
+            files_to_hash.append(md_file)
+    
+    # Calculate file hashes
+    file_hashes = get_file_hashes(files_to_hash)
+    
+    with ThreadPoolExecutor(max_workers=8) as write_executor:
+        pending_writes = []
         
-        # Get relative path for file identification
-        rel_path = os.path.relpath(md_file, input_dir)
-        file_stem = Path(md_file).stem
-        
-        # Save each chunk as a separate JSON file
-        for chunk in chunks:
-            chunk_id = f"{file_stem}_chunk_{chunk['chunk_index']}"
-            output_filename = f"{chunk_id}.json"
-            output_path = os.path.join(output_dir, output_filename)
+        for md_file in markdown_files:
+            if md_file not in file_stats:
+                continue
             
-            chunk_data = {
-                'chunk_id': chunk_id,
-                'chunk_index': chunk['chunk_index'],
-                'content': chunk['content'],
-                'source_file': rel_path,
-                'metadata': {
-                    'file_name': Path(md_file).name,
-                    'file_path': rel_path,
-                    'chunk_id': chunk_id,
-                    'chunk_index': chunk['chunk_index'],
-                    'char_count': chunk['char_count'],
-                    'source_type': 'markdown'
-                },
-                'original_message': {
-                    'content': chunk['content'],
-                }
-            }
+            # Check if file has been processed and hasn't changed
+            file_key = os.path.relpath(md_file, input_dir)
+            if md_file not in file_hashes:
+                print(f"Skipping '{file_key}' (no changes)")
+                skipped_count += 1
+                continue
+            
+            current_hash = file_hashes[md_file]
+            if current_hash is None:
+                continue
+            
+            size, mtime = file_stats[md_file]
+            entry = cache.get(file_key)
+            cached_hash = entry.get('hash') if isinstance(entry, dict) else entry
+            if cached_hash == current_hash:
+                # Content is unchanged (e.g. touched or copied); refresh the stat fields only
+                cache[file_key] = {'hash': current_hash, 'size': size, 'mtime': mtime}
+                print(f"Skipping '{file_key}' (no changes)")
+                skipped_count += 1
+                continue
+            
+            # Process the file
+            print(f"Processing '{file_key}'")
             
+            # Get relative path for file identification
+            rel_path = os.path.relpath(md_file, input_dir)
+            file_stem = Path(md_file).stem
+            # Output name and chunk ids come from the relative path, so a/notes.md and b/notes.md
+            # get separate files (top-level files keep their plain stem)
+            source_stem = _source_stem(rel_path)
+            
+            # Chunk, serialize and write the file on the pool so it overlaps with the next source;
+            # each chunk line is written as it is produced, so no whole-document payload is built
+            output_path = os.path.join(output_dir, f"{source_stem}_chunks.jsonl")
+            future = write_executor.submit(_write_chunks, md_file, rel_path, source_stem, output_path)
+            pending_writes.append((future, file_key, file_stem, rel_path, output_path,
+                                   {'hash': current_hash, 'size': size, 'mtime': mtime}))
+    
+        for future, file_key, file_stem, rel_path, output_path, cache_entry in pending_writes:
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(chunk_data, f, indent=2, ensure_ascii=False)
+                chunk_count = future.result()
             except Exception as e:
-                print(f"  Error saving chunk {chunk_id}: {e}")
+                print(f"  Error saving chunks to {output_path}: {e}")
+                continue
+            if not chunk_count:
+                print(f"  No content to chunk in '{file_key}'")
                 continue
+            
+            # Remove per-chunk JSON files left by older runs so chunks are not loaded twice
+            _remove_legacy_chunks(output_dir, file_stem, rel_path)
+            
+            # Update cache
+            cache[file_key] = cache_entry
+            processed_count += 1
+            print(f"  Created {chunk_count} chunks for '{file_key}'")
         
-        # Update cache
-        cache[file_key] = current_hash
-        processed_count += 1
-        print(f"  Created {len(chunks)} chunks")
-    
     # Save updated cache
-    try:
-        with open(cache_file, 'w') as f:
-            json.dump(cache, f, indent=2)
-    except Exception as e:
-        print(f"Warning: Could not save cache: {e}")
+    save_cache(cache, cache_file)
     
     print(f"\nMarkdown processing complete:")
     print(f"  Processed: {processed_count} files")
@@ -1,26 +1,47 @@
 # create_vectors.py
-import json
+import orjson
 import os
-import sys
-import hashlib
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pickle
-from tqdm import tqdm
-import time
+from pathlib import Path
 import requests
+from tqdm import tqdm
+from util import get_file_hashes, load_cache, save_cache, quantize_int8
 
-def get_file_hash(filepath):
-    """Calculate MD5 hash of a file's content."""
-    hash_md5 = hashlib.md5()
+# Opt in to encoding with a static (Model2Vec) distillation of the transformer instead of the full model.
+# Query encoding becomes a token-embedding lookup, at the cost of some retrieval recall.
+USE_STATIC_EMBEDDINGS = False
+# Opt in to encoding in FP16 on CUDA, or with dynamically int8-quantized Linear layers on CPU.
+# Queries are encoded by app.py's own ONNX/fp32 model, so a differently quantized corpus costs recall.
+USE_REDUCED_PRECISION = False
+# Also save an int8 copy of the embeddings with per-vector scales for int8 search
+SAVE_INT8_EMBEDDINGS = True
+
+def _load_chunked_file(file_path):
+    """
+    Load one chunked JSON file, flattening grouped messages.
+    
+    Args:
+        file_path (str): Path to the chunked JSON file
+    
+    Returns:
+        list: Messages from the file (empty on error)
+    """
+    messages = []
     try:
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        with open(file_path, 'rb') as file:
+            data = orjson.loads(file.read())
+            # Each file contains a list of messages
+            for item in data:
+                # If it's a grouped message (has 'messages' key), flatten it
+                if 'messages' in item and isinstance(item['messages'], list):
+                    for msg in item['messages']:
+                        messages.append(msg)
+                else:
+                    messages.append(item)
     except Exception as e:
-        print(f"Error calculating hash for {filepath}: {e}")
-        return None
+        print(f"Error loading {os.path.basename(file_path)}: {e}")
+    return messages
 
 def load_chunked_files(directory_path, cache_file='file_cache.json'):
     """
@@ -45,21 +66,17 @@ def load_chunked_files(directory_path, cache_file='file_cache.json'):
     print(f"Found {len(json_files)} chunked files to process:")
     
     # Load or create cache
-    file_cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                file_cache = json.load(f)
-        except Exception as e:
-            print(f"Error loading cache file: {e}")
+    file_cache = load_cache(cache_file)
     
     # Check which files need to be processed
     files_to_process = []
     files_to_skip = []
     
+    file_hashes = get_file_hashes([os.path.join(directory_path, json_file) for json_file in json_files])
+    
     for json_file in json_files:
         file_path = os.path.join(directory_path, json_file)
-        current_hash = get_file_hash(file_path)
+        current_hash = file_hashes[file_path]
         
         if current_hash is None:
             files_to_process.append(json_file)
@@ -79,76 +96,102 @@ def load_chunked_files(directory_path, cache_file='file_cache.json'):
         print(f"Processing {len(files_to_process)} files:")
         for json_file in files_to_process:
             print(f"  - {json_file}")
-            try:
-                with open(os.path.join(directory_path, json_file), 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                    # Each file contains a list of messages
-                    for item in data:
-                        # If it's a grouped message (has 'messages' key), flatten it
-                        if 'messages' in item and isinstance(item['messages'], list):
-                            for msg in item['messages']:
-                                all_messages.append(msg)
-                        else:
-                            all_messages.append(item)
-            except Exception as e:
-                print(f"Error loading {json_file}: {e}")
-    
-    # Update cache with new hashes
+        # Read and parse the files concurrently, merging in the original order
+        paths = [os.path.join(directory_path, json_file) for json_file in files_to_process]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            for messages in executor.map(_load_chunked_file, paths):
+                all_messages.extend(messages)
+    
+    # Update cache with new hashes (reusing the ones computed above)
     for json_file in json_files:
         file_path = os.path.join(directory_path, json_file)
-        current_hash = get_file_hash(file_path)
+        current_hash = file_hashes[file_path]
         if current_hash is not None:
             file_cache[json_file] = current_hash
     
     # Save updated cache
-    try:
-        with open(cache_file, 'w') as f:
-            json.dump(file_cache, f, indent=2)
-    except Exception as e:
-        print(f"Error saving cache file: {e}")
+    save_cache(file_cache, cache_file)
     
     return all_messages
 
+def _chunk_to_message(data, file_path):
+    """
+    Convert one markdown chunk record into a message.
+    
+    Args:
+        data (dict): Chunk record as written by chunk.py
+        file_path (str): Path of the file the record was read from
+    
+    Returns:
+        dict: Message for the chunk, or None if it is invalid
+    """
+    # Extract content and metadata
+    if 'content' not in data or 'metadata' not in data:
+        return None
+    
+    # Detect source type based on file path
+    source_type = 'markdown'  # default
+    file_name = data['metadata'].get('file_name', '')
+    if 'onenote' in file_path.lower() or 'onenote' in file_name.lower():
+        source_type = 'onenote'
+    
+    return {
+        'content': data['content'],
+        'source_file': file_name,
+        'source_type': source_type,
+        'file_path': data['metadata'].get('file_path', ''),
+        'chunk_id': data.get('chunk_id', ''),
+        'chunk_index': data.get('chunk_index', 0)
+    }
+
+def _load_markdown_chunk_file(file_path):
+    """
+    Load the chunks of one markdown chunk file.
+    
+    Reads a JSON Lines file (one chunk per line) or a legacy single-chunk JSON file.
+    
+    Args:
+        file_path (str): Path to the chunk file
+    
+    Returns:
+        list: Messages for the valid chunks in the file
+    """
+    messages = []
+    try:
+        with open(file_path, 'rb') as f:
+            if file_path.endswith('.jsonl'):
+                records = [orjson.loads(line) for line in f if line.strip()]
+            else:
+                records = [orjson.loads(f.read())]
+        for data in records:
+            message = _chunk_to_message(data, file_path)
+            if message is not None:
+                messages.append(message)
+    except Exception as e:
+        print(f"Error loading markdown chunk file {file_path}: {e}")
+    return messages
+
 def load_markdown_chunks(directory_path):
     """
-    Load all markdown chunked JSON files from the directory.
+    Load all markdown chunk files (.jsonl, or legacy per-chunk .json) from the directory.
     
     Args:
-        directory_path (str): Path to directory containing markdown chunked JSON files
+        directory_path (str): Path to directory containing markdown chunk files
         
     Returns:
-        list: List of all messages from all markdown chunked files
+        list: List of all messages from all markdown chunk files
     """
     all_messages = []
     
     # Walk through all subdirectories
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            if file.endswith('.json') and 'chunk' in file.lower():
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # Extract content and metadata
-                        if 'content' in data and 'metadata' in data:
-                            # Detect source type based on file path
-                            source_type = 'markdown'  # default
-                            file_name = data['metadata'].get('file_name', '')
-                            if 'onenote' in file_path.lower() or 'onenote' in file_name.lower():
-                                source_type = 'onenote'
-                            
-                            message = {
-                                'content': data['content'],
-                                'source_file': file_name,
-                                'source_type': source_type,
-                                'file_path': data['metadata'].get('file_path', ''),
-                                'chunk_id': data.get('chunk_id', ''),
-                                'chunk_index': data.get('chunk_index', 0),
-                                'original_message': data
-                            }
-                            all_messages.append(message)
-                except Exception as e:
-                    print(f"Error loading markdown chunk file {file_path}: {e}")
+    chunk_files = []
+    for pattern in ('*chunk*.json', '*chunk*.jsonl'):
+        chunk_files.extend(str(path) for path in Path(directory_path).rglob(pattern) if path.is_file())
+    
+    # Read and parse the chunk files concurrently, merging in walk order
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for messages in executor.map(_load_markdown_chunk_file, chunk_files):
+            all_messages.extend(messages)
     
     return all_messages
 
@@ -173,22 +216,117 @@ def reload_app_vectors():
         print(f"⚠ Error sending reload request: {e}")
         return False
 
-def create_vectors(messages, model_name='all-mpnet-base-v2', output_path='vectors.pkl'):
+def save_npy_atomic(path, array):
+    """
+    Save an array as .npy through a temporary file renamed into place.
+    
+    The app memory-maps these files, and truncating a mapped file in place crashes it (SIGBUS);
+    after the rename the live mapping keeps the old inode.
+    
+    Args:
+        path (str): Destination .npy path
+        array (np.ndarray): Array to save
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+def load_static_model(model_name, output_dir=None):
+    """
+    Distill a sentence transformer into a static Model2Vec model, reusing a saved copy if present.
+    
+    Args:
+        model_name (str): Name of the sentence transformer model to distill
+        output_dir (str): Directory the distilled model is saved to
+    
+    Returns:
+        tuple: (SentenceTransformer wrapping the static embedding, absolute path it was saved to)
+    """
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import StaticEmbedding
+    
+    if output_dir is None:
+        output_dir = f"static_{model_name.replace('/', '_')}"
+    # Absolute, because the path is stored as the model name and reloaded from other working directories
+    output_dir = os.path.abspath(output_dir)
+    
+    if os.path.isdir(output_dir):
+        print(f"Loading distilled static model from '{output_dir}'")
+        return SentenceTransformer(output_dir), output_dir
+    
+    print(f"Distilling '{model_name}' into a static embedding model...")
+    static_embedding = StaticEmbedding.from_distillation(model_name)
+    model = SentenceTransformer(modules=[static_embedding])
+    model.save(output_dir)
+    print(f"Static model saved to '{output_dir}'")
+    return model, output_dir
+
+def encode_by_token_length(model, contents, batch_size):
+    """
+    Encode contents in batches of similar token length to minimize padding.
+    
+    encode() only sorts by character length, so contents are ordered by tokenized
+    length here and each contiguous run is encoded as its own batch.
+    
+    Args:
+        model (SentenceTransformer): Model to encode with
+        contents (list): Strings to encode
+        batch_size (int): Number of strings per batch
+    
+    Returns:
+        np.ndarray: Normalized embeddings in the original order of contents
+    """
+    token_lengths = [len(ids) for ids in model.tokenizer(contents, add_special_tokens=False)['input_ids']]
+    order = np.argsort(token_lengths, kind='stable')
+    
+    embeddings = None
+    for start in tqdm(range(0, len(order), batch_size), desc="Creating embeddings"):
+        batch_indices = order[start:start + batch_size]
+        batch_embeddings = model.encode(
+            [contents[i] for i in batch_indices],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        if embeddings is None:
+            embeddings = np.empty((len(contents), batch_embeddings.shape[1]), dtype=batch_embeddings.dtype)
+        embeddings[batch_indices] = batch_embeddings
+    return embeddings
+
+def create_vectors(messages, model_name='all-mpnet-base-v2', embeddings_path='embeddings.npy', metadata_path='metadata.json'):
     """
     Create vector embeddings for messages using sentence transformers.
     
+    The embeddings are saved normalized as float16 .npy so the app can memory-map them,
+    and the metadata is written as a JSON sidecar without the model (the app loads it by name).
+    
     Args:
         messages (list): List of message objects
         model_name (str): Name of the sentence transformer model to use
-        output_path (str): Path to save the vector database
+        embeddings_path (str): Path to save the embeddings matrix
+        metadata_path (str): Path to save the model name and message metadata
     
     Returns:
         tuple: (embeddings, message_metadata)
     """
+    # Imported here so loading and hashing the chunk files does not pay for torch's startup
+    import torch
+    from sentence_transformers import SentenceTransformer
+    
     print(f"Loading sentence transformer model: {model_name}")
     
     # Load the sentence transformer model
-    model = SentenceTransformer(model_name)
+    if USE_STATIC_EMBEDDINGS:
+        model, model_name = load_static_model(model_name)
+    else:
+        model = SentenceTransformer(model_name)
+    
+    if USE_REDUCED_PRECISION:
+        if torch.cuda.is_available():
+            model = model.half().to('cuda')
+        else:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
     
     # Extract message content for vectorization
     message_contents = []
@@ -211,7 +349,7 @@ def create_vectors(messages, model_name='all-mpnet-base-v2', output_path='vector
                 'username': msg.get('username'),
                 'source_file': msg.get('source_file'),
                 'source_type': source_type,
-                'original_message': msg
+                'content': content
             }
             # Include discord_info if available
             if 'discord_info' in msg:
@@ -229,32 +367,52 @@ def create_vectors(messages, model_name='all-mpnet-base-v2', output_path='vector
     
     print(f"Vectorizing {len(message_contents)} messages...")
     
-    # Create embeddings with progress bar
+    # Create embeddings in batches with progress bar
     if message_contents:
-        embeddings = []
-        # Use tqdm for progress bar
-        for content in tqdm(message_contents, desc="Creating embeddings"):
-            embedding = model.encode(content)
-            embeddings.append(embedding)
+        # Encode each distinct content once and scatter the vectors back to every occurrence
+        unique_contents = {}
+        content_indices = [unique_contents.setdefault(content, len(unique_contents)) for content in message_contents]
+        print(f"Encoding {len(unique_contents)} unique contents")
         
-        embeddings = np.array(embeddings)
+        batch_size = 128 if torch.cuda.is_available() else 32
+        if USE_STATIC_EMBEDDINGS:
+            # Static embeddings are a pooled token lookup with no padding cost, so one call suffices
+            unique_embeddings = model.encode(
+                list(unique_contents),
+                batch_size=batch_size,
+                show_progress_bar=True,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+        else:
+            unique_embeddings = encode_by_token_length(model, list(unique_contents), batch_size)
+        embeddings = unique_embeddings[np.asarray(content_indices)]
         print(f"Created embeddings of shape: {embeddings.shape}")
     else:
         print("No content to vectorize")
         embeddings = np.array([])
     
-    # Save vector database
+    # Save vector database (embeddings are already normalized by encode)
+    save_npy_atomic(embeddings_path, np.ascontiguousarray(embeddings, dtype=np.float16))
+    if SAVE_INT8_EMBEDDINGS and embeddings.ndim == 2 and len(embeddings) > 0:
+        # Same per-vector quantization app.py applies at load
+        quantized, scales = quantize_int8(embeddings)
+        path_stem = os.path.splitext(embeddings_path)[0]
+        # The app only uses the int8 pair when the int8 file is at least as new as embeddings.npy,
+        # so it goes last: until then the old int8 files are older than the new embeddings and ignored
+        save_npy_atomic(f"{path_stem}.int8.scales.npy", scales)
+        save_npy_atomic(f"{path_stem}.int8.npy", quantized)
+    
     vector_database = {
         'model_name': model_name,
-        'embeddings': embeddings,
-        'message_metadata': message_metadata,
-        'model': model
+        'static_embeddings': USE_STATIC_EMBEDDINGS,
+        'message_metadata': message_metadata
     }
     
-    with open(output_path, 'wb') as f:
-        pickle.dump(vector_database, f)
+    with open(metadata_path, 'wb') as f:
+        f.write(orjson.dumps(vector_database, option=orjson.OPT_SERIALIZE_NUMPY))
     
-    print(f"Vectors saved to '{output_path}'")
+    print(f"Vectors saved to '{embeddings_path}' and '{metadata_path}'")
     return embeddings, message_metadata
 
 def main():
@@ -310,7 +468,8 @@ def main():
     embeddings, message_metadata = create_vectors(
         all_messages, 
         model_name='all-mpnet-base-v2',  # More powerful model
-        output_path='vectors.pkl'
+        embeddings_path='embeddings.npy',
+        metadata_path='metadata.json'
     )
     
     # Reload vectors in the Flask app
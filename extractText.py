@@ -1,13 +1,27 @@
-from pdf2image import convert_from_path
-import pytesseract
-import filetype
-from pdf2image.pdf2image import pdfinfo_from_path
-from multiprocessing import Pool, cpu_count
+import os
+# One Tesseract thread per worker; the pool already runs a worker per core
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+try:
+    from tesserocr import PyTessBaseAPI, PSM, RIL
+except ImportError:
+    # Without tesserocr, pages are rendered to files and OCRed by one batched tesseract CLI call
+    PyTessBaseAPI = None
+import subprocess
+import tempfile
+import fitz  # PyMuPDF
+from PIL import Image
+import numpy as np
+from multiprocessing import Pool, Process, Queue, cpu_count
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from tqdm import tqdm
 import pymupdf4llm
 import pymupdf4llm.helpers.document_layout as dl
-import os
 import sys
+import heapq
+import io
+import queue
+from util import iter_files
 
 # -----------------------------
 # Safety Patch for pymupdf4llm
@@ -21,79 +35,462 @@ def safe_list_item_to_md(textlines, level):
 
 dl.list_item_to_md = safe_list_item_to_md
 
+# OCR rendering DPI per quality preset; 300 DPI matches the resolution Tesseract's models are trained on.
+# "auto" picks the DPI per PDF from the size of its text (see estimate_ocr_dpi)
+QUALITY_PRESETS = {"fast": 200, "balanced": 300, "high": 500, "auto": None}
+# Auto DPI: probe render DPI, target text-line height in pixels, and allowed DPI range
+AUTO_DPI_PROBE = 100
+AUTO_DPI_LINE_HEIGHT = 40
+AUTO_DPI_RANGE = (150, 400)
+# Pages whose text layer has at least this many characters (after stripping) skip OCR
+MIN_TEXT_LAYER_CHARS = 20
+# Seconds the pipeline waits for a result before checking that its worker processes are alive
+PIPELINE_POLL_SECONDS = 5
+
 
 # -----------------------------
 # Worker for OCR (runs in parallel)
 # -----------------------------
+# (path, document) last opened by this process; pool workers persist between tasks, which
+# arrive one PDF at a time, so only the current file is kept open
+_open_document = (None, None)
+# Tesseract API of this worker process, created once by _init_worker
+_API = None
+
+def _init_worker():
+    """Pool initializer: load the Tesseract model once per worker instead of once per page."""
+    global _API
+    if _API is None and PyTessBaseAPI is not None:
+        _API = PyTessBaseAPI(lang="eng", psm=PSM.AUTO)
+
+def _imap_pages(func, args, workers, initializer=None, pool=None):
+    """
+    Yield func(arg) for every arg, across a page-level pool or, with a single worker,
+    in this process (file-level pool workers are daemonic and cannot start their own pool).
+    pool: already running pool to use instead of forking one for this call
+    """
+    # Hand out pages in chunks to cut dispatch overhead
+    chunksize = max(1, len(args) // ((workers or cpu_count()) * 4))
+    if pool is not None:
+        yield from pool.imap_unordered(func, args, chunksize=chunksize)
+        return
+    if workers == 1:
+        if initializer is not None:
+            initializer()
+        yield from map(func, args)
+        return
+    # Recycle workers to release raster memory
+    with Pool(workers, initializer=initializer, maxtasksperchild=8) as pool:
+        yield from pool.imap_unordered(func, args, chunksize=chunksize)
+
+def _get_document(file):
+    """Open a PDF once per worker process and reuse it for later pages, closing the previous PDF."""
+    global _open_document
+    path, doc = _open_document
+    if path != file:
+        _close_document()
+        doc = fitz.open(file)
+        _open_document = (file, doc)
+    return doc
+
+def _close_document():
+    """Close the PDF cached by _get_document in this process, if any."""
+    global _open_document
+    _, doc = _open_document
+    _open_document = (None, None)
+    if doc is not None:
+        doc.close()
+
+def _render_gray(file, page_number, dpi, preprocess=False):
+    """
+    Rasterize one page in grayscale (what tesseract works on anyway).
+    preprocess: threshold to black/white first (opt-in: too aggressive for faint scans)
+    Returns: (samples, width, height)
+    """
+    page = _get_document(file).load_page(page_number - 1)
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    samples = pixmap.samples
+    if preprocess and pixmap.width and pixmap.height:
+        pixels = np.frombuffer(samples, np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+        samples = ((pixels > pixels.mean() - 10).astype(np.uint8) * 255).tobytes()
+    return samples, pixmap.width, pixmap.height
+
+def render_page(args):
+    """
+    Worker function for the CLI fallback: rasterize one page to a grayscale image file.
+    args: (filepath, page_number, dpi, preprocess, output_dir)
+    Returns: (page_number, image_path_or_None, error_or_None)
+    """
+    file, page_number, dpi, preprocess, output_dir = args
+    try:
+        samples, width, height = _render_gray(file, page_number, dpi, preprocess)
+        if width == 0 or height == 0:
+            return page_number, None, f"[ERROR page {page_number}: no image produced]"
+        image_path = os.path.join(output_dir, f"page_{page_number:05d}.pgm")
+        Image.frombytes("L", (width, height), samples).save(image_path)
+        return page_number, image_path, None
+    except Exception as e:
+        return page_number, None, f"[ERROR page {page_number}: {repr(e)}]"
+
+def ocr_pages_with_cli(file, page_numbers, workers, dpi, preprocess=False, pool=None):
+    """
+    OCR pages with a single tesseract invocation over an image list file,
+    so the model is loaded once per document instead of once per page.
+    Returns: dict of page_number -> text_or_error
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args = [(file, page, dpi, preprocess, tmp_dir) for page in page_numbers]
+        rendered = []
+        for page_num, image_path, error in tqdm(_imap_pages(render_page, args, workers, pool=pool),
+                                                 total=len(args),
+                                                 desc="Render Progress",
+                                                 unit="page"):
+            if error is None:
+                rendered.append((page_num, image_path))
+            else:
+                results[page_num] = error
+        if not rendered:
+            return results
+
+        rendered.sort()
+        list_path = os.path.join(tmp_dir, "list.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(image_path for _, image_path in rendered) + "\n")
+
+        print(f"Running tesseract once over {len(rendered)} page image(s)")
+        try:
+            completed = subprocess.run(["tesseract", list_path, "stdout", "-l", "eng"],
+                                       capture_output=True, text=True, check=True)
+            # tesseract ends every page with a form feed, leaving one empty piece after the last page
+            page_texts = completed.stdout.split("\x0c")
+        except Exception as e:
+            page_texts = []
+            print(f"Error running tesseract: {repr(e)}")
+        if len(page_texts) != len(rendered) + 1:
+            # Texts are matched to pages by position, so a skipped image would shift every later page
+            reason = "no text returned by tesseract"
+            if page_texts:
+                print(f"Error: tesseract returned {len(page_texts) - 1} page(s) for {len(rendered)} image(s)")
+                reason = "tesseract page count mismatch"
+            for page_num, _ in rendered:
+                results[page_num] = f"[ERROR page {page_num}: {reason}]"
+            return results
+        for (page_num, _), text in zip(rendered, page_texts):
+            results[page_num] = text
+    return results
+
 def ocr_page(args):
     """
     Worker function for multiprocessing pool.
-    args: (filepath, page_number, dpi)
+    args: (filepath, page_number, dpi, preprocess)
     Returns: (page_number, text_or_error)
     """
-    file, page_number, dpi = args
+    file, page_number, dpi, preprocess = args
     try:
-        # convert only the requested page
-        imgs = convert_from_path(
-            file,
-            dpi=dpi,
-            first_page=page_number,
-            last_page=page_number,
-            fmt='ppm'  # use a light-weight format to reduce I/O overhead
-        )
-        if not imgs:
+        # render only the requested page
+        samples, width, height = _render_gray(file, page_number, dpi, preprocess)
+        if width == 0 or height == 0:
             return page_number, f"[ERROR page {page_number}: no image produced]"
-        img = imgs[0]
-        text = pytesseract.image_to_string(img)
+        img = Image.frombytes("L", (width, height), samples)
+        _API.SetImage(img)
+        text = _API.GetUTF8Text()
         return page_number, text
     except Exception as e:
         return page_number, f"[ERROR page {page_number}: {repr(e)}]"
 
 
 # -----------------------------
-# Get page count with fallback
+# Pipelined render -> OCR stages
 # -----------------------------
-def get_page_count(file_path):
-    """Get page count with fallback for when pdfinfo fails"""
+def _render_worker(file, dpi, preprocess, task_q, render_q):
+    """Renderer process: rasterize page numbers from task_q into render_q until a None pill."""
+    while True:
+        page_number = task_q.get()
+        if page_number is None:
+            break
+        try:
+            samples, width, height = _render_gray(file, page_number, dpi, preprocess)
+            render_q.put((page_number, samples, width, height, None))
+        except Exception as e:
+            render_q.put((page_number, None, 0, 0, f"[ERROR page {page_number}: {repr(e)}]"))
+
+def _ocr_worker(render_q, result_q):
+    """OCR process: recognize rendered pages from render_q into result_q until a None pill."""
+    _init_worker()
+    while True:
+        item = render_q.get()
+        if item is None:
+            break
+        page_number, samples, width, height, error = item
+        if error is None and (width == 0 or height == 0):
+            error = f"[ERROR page {page_number}: no image produced]"
+        if error is not None:
+            result_q.put((page_number, error))
+            continue
+        try:
+            _API.SetImage(Image.frombytes("L", (width, height), samples))
+            result_q.put((page_number, _API.GetUTF8Text()))
+        except Exception as e:
+            result_q.put((page_number, f"[ERROR page {page_number}: {repr(e)}]"))
+
+def ocr_pages_pipelined(file, page_numbers, workers, dpi, preprocess=False):
+    """
+    OCR pages with separate renderer and OCR processes joined by a bounded queue,
+    so rasterizing the next pages overlaps with recognizing the current ones.
+    Yields: (page_number, text_or_error) as pages finish; if a worker process dies
+    (e.g. a Tesseract segfault or an OOM kill), every page not yet done is yielded as an error
+    """
+    # Tesseract is the slower stage, so it gets most of the processes (e.g. 2 renderers : 6 OCRers on 8)
+    n_render = max(1, workers // 4)
+    n_ocr = max(1, workers - n_render)
+    print(f"Pipelining {n_render} renderer(s) into {n_ocr} OCR worker(s)")
+
+    task_q = Queue()
+    render_q = Queue(maxsize=workers * 2)  # bounds the rendered pages held in memory
+    result_q = Queue()
+    for page_number in page_numbers:
+        task_q.put(page_number)
+    for _ in range(n_render):
+        task_q.put(None)
+
+    processes = [Process(target=_render_worker, args=(file, dpi, preprocess, task_q, render_q)) for _ in range(n_render)]
+    processes += [Process(target=_ocr_worker, args=(render_q, result_q)) for _ in range(n_ocr)]
+    for process in processes:
+        process.start()
+
+    done = set()
+    finished = False
     try:
-        # Try the original method first
-        info = pdfinfo_from_path(file_path)
-        if 'Pages' in info:
-            return int(info['Pages'])
-    except Exception as e:
-        print(f"Warning: Could not get page count using pdfinfo: {e}")
-    
-    # Fallback: try to get page count using pymupdf
+        with tqdm(total=len(page_numbers), desc="OCR Progress", unit="page") as progress:
+            while len(done) < len(page_numbers):
+                try:
+                    page_number, text = result_q.get(timeout=PIPELINE_POLL_SECONDS)
+                except queue.Empty:
+                    dead = [process for process in processes if process.exitcode not in (None, 0)]
+                    if not dead:
+                        continue
+                    print(f"Warning: {len(dead)} pipeline worker(s) died (exit code {dead[0].exitcode}), "
+                          f"failing {len(page_numbers) - len(done)} unfinished page(s)")
+                    for page_number in page_numbers:
+                        if page_number not in done:
+                            yield page_number, f"[ERROR page {page_number}: pipeline worker process died]"
+                    return
+                done.add(page_number)
+                progress.update()
+                yield page_number, text
+        finished = True
+    finally:
+        if finished:
+            # Every page is done, so the renderers have exited; stop the OCR workers
+            for _ in range(n_ocr):
+                render_q.put(None)
+        else:
+            # A worker died or the caller stopped iterating: don't wait on queued pages
+            for q in (task_q, render_q, result_q):
+                q.cancel_join_thread()
+            for process in processes:
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+# -----------------------------
+# Parallel pymupdf4llm markdown
+# -----------------------------
+def markdown_pages(args):
+    """
+    Worker function: run pymupdf4llm layout analysis on a contiguous range of pages
+    (the safety patch above is applied on import, so workers have it too).
+    args: (filepath, chunk_index, page_indices)
+    Returns: (chunk_index, markdown)
+    """
+    file, chunk_index, pages = args
+    return chunk_index, pymupdf4llm.to_markdown(_get_document(file), pages=pages)
+
+def markdown_in_parallel(file, page_count, workers, pool=None):
+    """
+    Convert a PDF to markdown with pymupdf4llm, splitting its pages into one contiguous
+    range per worker and concatenating the ranges in page order.
+    """
+    n_chunks = min(workers, page_count)
+    args = [(file, i, list(range(i * page_count // n_chunks, (i + 1) * page_count // n_chunks)))
+            for i in range(n_chunks)]
+    chunks = [None] * n_chunks
+    for chunk_index, markdown in _imap_pages(markdown_pages, args, workers, pool=pool):
+        chunks[chunk_index] = markdown
+    return "".join(chunks)
+
+
+# -----------------------------
+# Auto DPI from text-line height
+# -----------------------------
+def estimate_ocr_dpi(file, page_number):
+    """
+    Pick the DPI that renders text lines about AUTO_DPI_LINE_HEIGHT pixels tall, from the
+    median Tesseract text-line height on a quick low-DPI render of one page. Oversized scans
+    get downsampled instead of feeding Tesseract pixels its recognizer doesn't need.
+    Returns: DPI clamped to AUTO_DPI_RANGE (the "balanced" preset if it can't be measured)
+    """
+    default = QUALITY_PRESETS["balanced"]
+    if PyTessBaseAPI is None:
+        print(f"Warning: auto DPI needs tesserocr, using {default} DPI")
+        return default
     try:
-        import fitz  # PyMuPDF
-        doc = fitz.open(file_path)
-        page_count = doc.page_count
-        doc.close()
-        return page_count
+        with fitz.open(file) as doc:
+            pixmap = doc.load_page(page_number - 1).get_pixmap(dpi=AUTO_DPI_PROBE, colorspace=fitz.csGRAY)
+        with PyTessBaseAPI(lang="eng", psm=PSM.AUTO) as api:
+            api.SetImage(Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples))
+            heights = sorted(box["h"] for _, box, _, _ in api.GetComponentImages(RIL.TEXTLINE, True))
     except Exception as e:
-        print(f"Warning: Could not get page count using PyMuPDF: {e}")
-    
-    # Final fallback: try to get page count using pdfinfo command
+        print(f"Warning: Could not measure text lines of {file}, using {default} DPI: {e}")
+        return default
+    if not heights:
+        return default
+    dpi = int(AUTO_DPI_PROBE * AUTO_DPI_LINE_HEIGHT / max(1, heights[len(heights) // 2]))
+    return max(AUTO_DPI_RANGE[0], min(AUTO_DPI_RANGE[1], dpi))
+
+
+# -----------------------------
+# Get page count
+# -----------------------------
+def get_page_count(file_path):
+    """Get page count by opening the PDF with PyMuPDF (no pdfinfo subprocess); 0 if it can't be opened"""
     try:
-        import subprocess
-        result = subprocess.run(['pdfinfo', file_path], 
-                              capture_output=True, text=True, check=True)
-        for line in result.stdout.split('\n'):
-            if line.startswith('Pages:'):
-                return int(line.split(':')[1].strip())
+        with fitz.open(file_path) as doc:
+            return doc.page_count
     except Exception as e:
-        print(f"Warning: Could not get page count using pdfinfo command: {e}")
-    
-    # If all methods fail, assume 1 page
-    print(f"Warning: Could not determine page count for {file_path}, assuming 1 page")
-    return 1
+        print(f"Warning: Could not get page count for {file_path}: {e}")
+        return 0
+
+
+# -----------------------------
+# Per-page text: text layer where present, OCR otherwise
+# -----------------------------
+def iter_page_texts(file, page_count, workers, dpi, force_ocr=False, doc=None, pipeline=False, preprocess=False, pool=None):
+    """
+    Yield (page_number, text) for every page as soon as it is available (not in page order),
+    OCRing only pages without a usable text layer.
+    doc: already opened fitz document for file, reused for the text layer probe
+    pipeline: OCR with separate renderer and OCR processes (needs tesserocr and 2+ workers)
+    preprocess: threshold rendered pages to black/white before OCR
+    pool: already running Pool (initialized with _init_worker) to OCR on instead of forking one
+    dpi: None to estimate it once for the whole PDF from its first page that needs OCR
+    """
+    workers = workers or cpu_count()
+    ocr_pages = list(range(1, page_count + 1))
+
+    if not force_ocr:
+        # Born-digital pages already carry their text; only scanned pages need OCR
+        ocr_pages = []
+        page_number = 1
+        try:
+            probe_doc = doc if doc is not None else fitz.open(file)
+            for page_number in range(1, page_count + 1):
+                text = probe_doc.load_page(page_number - 1).get_text("text")
+                if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+                    yield page_number, text
+                else:
+                    ocr_pages.append(page_number)
+            if doc is None:
+                probe_doc.close()
+        except Exception as e:
+            print(f"Warning: Could not read text layer of {file}, OCRing remaining pages: {e}")
+            ocr_pages.extend(range(page_number, page_count + 1))
+        print(f"{page_count - len(ocr_pages)} page(s) have a text layer, {len(ocr_pages)} need OCR")
+
+    if ocr_pages and dpi is None:
+        dpi = estimate_ocr_dpi(file, ocr_pages[0])
+        print(f"Auto DPI for {file}: {dpi}")
+
+    if ocr_pages and PyTessBaseAPI is None:
+        print(f"Using {workers} worker(s) for rendering and the tesseract CLI for OCR; DPI={dpi}")
+        yield from ocr_pages_with_cli(file, ocr_pages, workers, dpi, preprocess, pool).items()
+    elif ocr_pages and pipeline and workers > 1:
+        yield from ocr_pages_pipelined(file, ocr_pages, workers, dpi, preprocess)
+    elif ocr_pages:
+        print(f"Using {workers} worker(s) for OCR; DPI={dpi}")
+        args = [(file, page, dpi, preprocess) for page in ocr_pages]
+        yield from tqdm(_imap_pages(ocr_page, args, workers, initializer=_init_worker, pool=pool),
+                        total=len(args),
+                        desc="OCR Progress",
+                        unit="page")
+
+def extract_page_texts(file, page_count, workers, dpi, force_ocr=False, doc=None, pipeline=False, preprocess=False, pool=None):
+    """
+    Get the text of every page, OCRing only pages without a usable text layer.
+    Returns: list of page texts in page order
+    """
+    texts = [None] * page_count
+    for page_num, text in iter_page_texts(file, page_count, workers, dpi, force_ocr, doc, pipeline, preprocess, pool):
+        texts[page_num - 1] = text
+    return texts
+
+def write_pages_in_order(pages, output_file, format_page=None, page_count=None):
+    """
+    Stream (page_number, text) results to output_file in page order as they arrive,
+    buffering only out-of-order pages in a min-heap. Pages are separated by a newline,
+    as in the in-memory join, and optionally wrapped by format_page(page_number, text).
+    output_file: path to write, or an open text stream such as io.StringIO
+    page_count: pages expected; any that never arrive are written as error entries
+    A path is written to output_file + ".tmp" first and renamed when complete, so a crash
+    mid-document never leaves a truncated file that looks finished.
+    """
+    if not isinstance(output_file, str):
+        _write_pages(pages, output_file, format_page, page_count)
+        return
+    temp_output_file = output_file + ".tmp"
+    try:
+        with open(temp_output_file, 'w', encoding='utf-8') as f:
+            _write_pages(pages, f, format_page, page_count)
+    except BaseException:
+        if os.path.exists(temp_output_file):
+            os.remove(temp_output_file)
+        raise
+    os.replace(temp_output_file, output_file)
+
+def _write_pages(pages, f, format_page, page_count):
+    pending = []
+    next_page = 1
+
+    def write(page_number, text):
+        if page_number > 1:
+            f.write("\n")
+        f.write(format_page(page_number, text) if format_page else text)
+
+    for page in pages:
+        heapq.heappush(pending, page)
+        while pending and pending[0][0] <= next_page:
+            page_number, text = heapq.heappop(pending)
+            if page_number < next_page:
+                # Already written (a backend yielded it twice); a stale entry would block every later page
+                print(f"Warning: page {page_number} was produced more than once, keeping the first")
+                continue
+            write(page_number, text)
+            next_page += 1
+
+    # Pages that never arrived would otherwise hold back everything after them
+    last_page = max([page_count or 0] + [page_number for page_number, _ in pending])
+    missing = []
+    while next_page <= last_page:
+        if pending and pending[0][0] < next_page:
+            heapq.heappop(pending)
+            continue
+        if pending and pending[0][0] == next_page:
+            write(*heapq.heappop(pending))
+        else:
+            missing.append(next_page)
+            write(next_page, f"[ERROR page {next_page}: no result]")
+        next_page += 1
+    if missing:
+        print(f"Warning: no result for page(s) {missing}, wrote error entries in their place")
 
 
 # -----------------------------
 # Save result to file with directory structure preservation
 # -----------------------------
-def save_result_to_file(input_file, result, format, output_dir, input_base_dir):
-    """Save extraction result to file preserving directory structure"""
+def get_output_path(input_file, format, output_dir, input_base_dir):
+    """Build (and create the directories for) the output path of input_file, preserving directory structure"""
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
@@ -113,20 +510,30 @@ def save_result_to_file(input_file, result, format, output_dir, input_base_dir):
         output_file = os.path.join(output_subdir, f"{filename}.{format}")
     else:
         output_file = os.path.join(output_dir, f"{filename}.{format}")
-    
-    # Write result to file
+    return output_file
+
+
+def write_result(output_file, result):
+    """Write an in-memory extraction result to output_file"""
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
+        # Renamed into place once written, like write_pages_in_order
+        with open(output_file + ".tmp", 'w', encoding='utf-8') as f:
             f.write(result)
+        os.replace(output_file + ".tmp", output_file)
         print(f"Saved result to {output_file}")
     except Exception as e:
         print(f"Error saving to file {output_file}: {repr(e)}")
 
 
+def save_result_to_file(input_file, result, format, output_dir, input_base_dir):
+    """Save extraction result to file preserving directory structure"""
+    write_result(get_output_path(input_file, format, output_dir, input_base_dir), result)
+
+
 # -----------------------------
 # Main Extract Function
 # -----------------------------
-def main(file_or_folder, format="markdown", workers=None, dpi_text=800, dpi_md=800, output_dir=None):
+def main(file_or_folder, format="markdown", workers=None, dpi_text=300, dpi_md=300, output_dir=None, quality=None, force_ocr=False, pipeline=False, preprocess=False):
     """
     file_or_folder: path to PDF or folder containing PDFs
     format: "text" or "markdown"
@@ -134,6 +541,10 @@ def main(file_or_folder, format="markdown", workers=None, dpi_text=800, dpi_md=8
     dpi_text: DPI for text extraction
     dpi_md: DPI for markdown extraction
     output_dir: directory to save extracted files
+    quality: optional preset ("fast", "balanced", "high", "auto") overriding both DPIs
+    force_ocr: OCR every page even when it has a text layer
+    pipeline: overlap page rendering and OCR in separate processes
+    preprocess: threshold rendered pages to black/white before OCR
     """
     if workers is None:
         workers = max(1, cpu_count() - 0)  # allow tuning
@@ -141,11 +552,7 @@ def main(file_or_folder, format="markdown", workers=None, dpi_text=800, dpi_md=8
     # Check if input is a folder or single file
     if os.path.isdir(file_or_folder):
         # Process all PDFs in the folder and subfolders
-        pdf_files = []
-        for root, dirs, files in os.walk(file_or_folder):
-            for file in files:
-                if file.lower().endswith('.pdf'):
-                    pdf_files.append(os.path.join(root, file))
+        pdf_files = sorted(iter_files(file_or_folder, '.pdf'))
         
         if not pdf_files:
             print(f"No PDF files found in '{file_or_folder}' or its subfolders")
@@ -153,64 +560,161 @@ def main(file_or_folder, format="markdown", workers=None, dpi_text=800, dpi_md=8
         
         print(f"Found {len(pdf_files)} PDF files to process")
         
-        # Process each PDF file
+        # Many small PDFs: fork once and run whole files in parallel, OCRing each serially.
+        # With at least 4 files per worker every worker stays busy on whole files, so no PDF is
+        # opened up front; with fewer, a PDF with many pages keeps page-level parallelism instead
+        # (the probe stops at the first one; a file that can't be opened counts as small and is
+        # reported when it is processed).
+        many_pages = 4 * workers
+        file_level = len(pdf_files) > 1 and workers > 1 and (
+            len(pdf_files) >= many_pages
+            or all(get_page_count(pdf_file) < many_pages for pdf_file in pdf_files)
+        )
+        if file_level:
+            print(f"Processing files in parallel with {workers} worker(s)")
+            # Workers write their own output files, so only paths come back when output_dir is set
+            args = [(pdf_file, format, dpi_text, dpi_md, quality, force_ocr, preprocess,
+                     get_output_path(pdf_file, format, output_dir, file_or_folder) if output_dir else None)
+                    for pdf_file in pdf_files]
+            results = _process_files_in_pool(args, workers)
+            return [(pdf_file, results[pdf_file]) for pdf_file in pdf_files]
+        
+        # Process each PDF file, sharing one page-level pool instead of forking one per PDF.
+        # Text-mode --pipeline OCR starts its own renderer/OCR processes per PDF, so it gets no pool.
         results = []
-        for pdf_file in tqdm(pdf_files, desc="Processing PDFs", unit="file"):
-            try:
-                result = process_single_pdf(pdf_file, format, workers, dpi_text, dpi_md)
-                results.append((pdf_file, result))
-                
-                # Save to file if output_dir is specified
-                if output_dir:
-                    save_result_to_file(pdf_file, result, format, output_dir, file_or_folder)
-                    
-            except Exception as e:
-                print(f"Error processing {pdf_file}: {repr(e)}")
-                results.append((pdf_file, f"[ERROR] {repr(e)}"))
+        pipelined = pipeline and PyTessBaseAPI is not None and format == "txt"
+        pool = Pool(workers, initializer=_init_worker, maxtasksperchild=8) if workers > 1 and not pipelined else None
+        try:
+            for pdf_file in tqdm(pdf_files, desc="Processing PDFs", unit="file"):
+                try:
+                    # Save to file if output_dir is specified (page text is streamed straight to it)
+                    output_file = get_output_path(pdf_file, format, output_dir, file_or_folder) if output_dir else None
+                    result = process_single_pdf(pdf_file, format, workers, dpi_text, dpi_md, quality, force_ocr, pipeline,
+                                                output_file, preprocess, pool)
+                    results.append((pdf_file, result))
+                        
+                except Exception as e:
+                    print(f"Error processing {pdf_file}: {repr(e)}")
+                    results.append((pdf_file, f"[ERROR] {repr(e)}"))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
         
         return results
         
     else:
         # Single file processing (original behavior)
-        return process_single_pdf(file_or_folder, format, workers, dpi_text, dpi_md)
+        return process_single_pdf(file_or_folder, format, workers, dpi_text, dpi_md, quality, force_ocr, pipeline, preprocess=preprocess)
 
 
-def process_single_pdf(file, format="markdown", workers=None, dpi_text=800, dpi_md=800):
-    """Process a single PDF file"""
-    kind = filetype.guess(file)
-    if kind is None:
-        print(f"Couldn't guess file type for '{file}'")
-        return "--unsupported file--"
-    print(f"file '{file}' is a '{kind.extension}' file")
+def _process_files_in_pool(args, workers):
+    """
+    Run _process_one_pdf_wrapper over every args tuple on a file-level process pool.
+    A worker killed mid-file (Tesseract segfault, OOM kill) breaks the pool instead of hanging it;
+    unfinished files are then retried one at a time, where the first unfinished file is the one
+    that took the worker down and is recorded as an error.
+    Returns: dict of filepath -> result_or_output_file
+    """
+    results = {}
+    remaining = list(args)
+    while remaining:
+        broken = set()
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+            futures = {executor.submit(_process_one_pdf_wrapper, arg): arg for arg in remaining}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing PDFs", unit="file"):
+                try:
+                    pdf_file, result = future.result()
+                    results[pdf_file] = result
+                except BrokenProcessPool:
+                    broken.add(futures[future][0])
+        remaining = [arg for arg in remaining if arg[0] in broken]
+        if not remaining:
+            break
+        if workers == 1:
+            # One file at a time runs them in order, so the first unfinished file crashed the worker
+            pdf_file = remaining.pop(0)[0]
+            print(f"Error processing {pdf_file}: worker process died")
+            results[pdf_file] = "[ERROR] worker process died"
+        else:
+            print(f"Warning: a worker process died, retrying {len(remaining)} unfinished file(s) one at a time")
+            workers = 1
+    return results
+
 
-    if kind.extension != "pdf":
-        print(f"unsupported file type '{kind.extension}'!")
+def _process_one_pdf_wrapper(args):
+    """
+    Worker function for the file-level pool: process one whole PDF in this worker.
+    args: (filepath, format, dpi_text, dpi_md, quality, force_ocr, preprocess, output_file_or_None)
+    Returns: (filepath, result_or_output_file)
+    """
+    file, format, dpi_text, dpi_md, quality, force_ocr, preprocess, output_file = args
+    try:
+        return file, process_single_pdf(file, format, 1, dpi_text, dpi_md, quality, force_ocr,
+                                        output_file=output_file, preprocess=preprocess)
+    except Exception as e:
+        print(f"Error processing {file}: {repr(e)}")
+        return file, f"[ERROR] {repr(e)}"
+
+
+def process_single_pdf(file, format="markdown", workers=None, dpi_text=300, dpi_md=300, quality=None, force_ocr=False, pipeline=False, output_file=None, preprocess=False, pool=None):
+    """
+    Process a single PDF file.
+    With output_file, the result is saved there instead (page text is streamed as pages
+    finish rather than held in memory) and the output path is returned.
+    pool: already running Pool (initialized with _init_worker) to OCR on; one is forked per call otherwise
+    """
+    if quality is not None:
+        dpi_text = dpi_md = QUALITY_PRESETS[quality]
+
+    result = _open_and_extract(file, format, workers, dpi_text, dpi_md, force_ocr, pipeline, preprocess, output_file, pool)
+    if output_file is None:
+        return result
+    if result is not None:
+        write_result(output_file, result)
+    return output_file
+
+
+def _open_and_extract(file, format, workers, dpi_text, dpi_md, force_ocr, pipeline, preprocess, output_file, pool=None):
+    """Open and validate a PDF, then extract it (None if the result was streamed to output_file)"""
+    # One open both validates the file and gives the page count
+    try:
+        doc = fitz.open(file)
+    except Exception as e:
+        print(f"Couldn't open '{file}': {e}")
         return "--unsupported file--"
 
+    with doc:
+        if not doc.is_pdf:
+            print(f"unsupported file type for '{file}'!")
+            return "--unsupported file--"
+        print(f"file '{file}' is a 'pdf' file")
+        try:
+            return _extract_document(file, doc, format, workers, dpi_text, dpi_md, force_ocr, pipeline, preprocess, output_file, pool)
+        finally:
+            # In-process (single worker) page tasks cached their own handle to this file here
+            _close_document()
+
+
+def _extract_document(file, doc, format, workers, dpi_text, dpi_md, force_ocr, pipeline, preprocess, output_file=None, pool=None):
+    """Extract an opened PDF as text or markdown (None if the page text was streamed to output_file)"""
+    page_count = doc.page_count
+
     # -----------------------------
     # TEXT mode (parallel OCR)
     # -----------------------------
     if format == "txt":
-        try:
-            page_count = get_page_count(file)
-        except Exception as e:
-            print(f"Error getting page count for {file}: {e}")
-            page_count = 1  # fallback
-            
         if page_count <= 0:
             print(f"Warning: PDF {file} has no pages")
             return ""
             
-        print(f"Using {workers} worker(s) for OCR; DPI={dpi_text}")
-        args = [(file, page, dpi_text) for page in range(1, page_count + 1)]
+        if output_file:
+            write_pages_in_order(iter_page_texts(file, page_count, workers, dpi_text, force_ocr, doc, pipeline, preprocess, pool),
+                                 output_file, page_count=page_count)
+            print(f"Saved result to {output_file}")
+            return None
 
-        texts = [None] * page_count
-        with Pool(workers) as pool:
-            for page_num, text in tqdm(pool.imap_unordered(ocr_page, args),
-                                        total=page_count,
-                                        desc="OCR Progress",
-                                        unit="page"):
-                texts[page_num - 1] = text
+        texts = extract_page_texts(file, page_count, workers, dpi_text, force_ocr, doc, pipeline, preprocess, pool)
 
         return "\n".join(texts)
 
@@ -221,40 +725,34 @@ def process_single_pdf(file, format="markdown", workers=None, dpi_text=800, dpi_
         # First, try the library's to_markdown with its native signature
         try:
             print("Attempting high-quality pymupdf4llm.to_markdown() (library default).")
-            markdown = pymupdf4llm.to_markdown(file)  # removed unsupported kwargs
+            workers = workers or cpu_count()
+            if workers > 1 and page_count > 1:
+                markdown = markdown_in_parallel(file, page_count, workers, pool)
+            else:
+                markdown = pymupdf4llm.to_markdown(doc)  # removed unsupported kwargs
             print("High-quality extraction succeeded.")
             return markdown
         except Exception as e:
             print(f"High-quality markdown extraction failed: {e}")
             print("Falling back to multiprocess page-by-page OCR -> markdown...")
 
-            try:
-                page_count = get_page_count(file)
-            except Exception as e:
-                print(f"Error getting page count for {file}: {e}")
-                page_count = 1  # fallback
-                
             if page_count <= 0:
                 print(f"Warning: PDF {file} has no pages")
                 return ""
                 
-            print(f"Using {workers} worker(s) for fallback OCR; DPI={dpi_md}")
-            args = [(file, page, dpi_md) for page in range(1, page_count + 1)]
-
-            results = [None] * page_count
-            with Pool(workers) as pool:
-                for page_num, text in tqdm(pool.imap_unordered(ocr_page, args),
-                                            total=page_count,
-                                            desc="OCR Progress",
-                                            unit="page"):
-                    results[page_num - 1] = text
-
             # assemble markdown with simple page separators
-            md_blocks = []
-            for i, page_text in enumerate(results, start=1):
-                md_blocks.append(f"# Page {i}\n\n{page_text}\n\n---\n")
+            format_page = lambda i, page_text: f"# Page {i}\n\n{page_text}\n\n---\n"
+            if output_file:
+                write_pages_in_order(iter_page_texts(file, page_count, workers, dpi_md, force_ocr, doc, pipeline, preprocess, pool),
+                                     output_file, format_page, page_count)
+                print(f"Saved result to {output_file}")
+                return None
 
-            return "\n".join(md_blocks)
+            # Write pages into one growing buffer as they arrive instead of joining a list of blocks
+            buffer = io.StringIO()
+            write_pages_in_order(iter_page_texts(file, page_count, workers, dpi_md, force_ocr, doc, pipeline, preprocess, pool),
+                                 buffer, format_page, page_count)
+            return buffer.getvalue()
 
     else:
         print(f"Unknown format '{format}'")
@@ -268,8 +766,12 @@ if __name__ == "__main__":
     # Default values
     format = "text"
     workers = None
-    dpi_text = 800
-    dpi_md = 800
+    dpi_text = 300
+    dpi_md = 300
+    quality = None
+    force_ocr = False
+    pipeline = False
+    preprocess = False
     output_dir = None
     input_path = None
     
@@ -289,6 +791,18 @@ if __name__ == "__main__":
         elif arg == "--dpi-md" and i + 1 < len(sys.argv):
             dpi_md = int(sys.argv[i + 1])
             i += 2
+        elif arg == "--quality" and i + 1 < len(sys.argv):
+            quality = sys.argv[i + 1]
+            i += 2
+        elif arg == "--force-ocr":
+            force_ocr = True
+            i += 1
+        elif arg == "--pipeline":
+            pipeline = True
+            i += 1
+        elif arg == "--preprocess":
+            preprocess = True
+            i += 1
         elif arg == "--output-dir" and i + 1 < len(sys.argv):
             output_dir = sys.argv[i + 1]
             i += 2
@@ -297,18 +811,22 @@ if __name__ == "__main__":
             i += 1
     
     # Validate input
-    if not input_path:
+    if not input_path or (quality is not None and quality not in QUALITY_PRESETS):
         print("Usage: python extract_text.py <input_path> [options]")
         print("Options:")
         print("  --format <text|markdown>     Output format (default: text)")
         print("  --workers <number>           Number of parallel workers (default: CPU count)")
-        print("  --dpi-text <number>          DPI for text extraction (default: 800)")
-        print("  --dpi-md <number>            DPI for markdown extraction (default: 800)")
+        print("  --dpi-text <number>          DPI for text extraction (default: 300, the resolution Tesseract is trained on)")
+        print("  --dpi-md <number>            DPI for markdown extraction (default: 300)")
+        print("  --quality <fast|balanced|high|auto>  DPI preset (200/300/500, or sized to the text), overrides --dpi-text/--dpi-md")
+        print("  --force-ocr                  OCR every page, even pages with a text layer")
+        print("  --pipeline                   Overlap page rendering and OCR in separate processes")
+        print("  --preprocess                 Threshold pages to black/white before OCR (may hurt faint scans)")
         print("  --output-dir <path>          Directory to save output files")
         sys.exit(1)
     
     # Process the input
-    results = main(input_path, format, workers, dpi_text, dpi_md, output_dir)
+    results = main(input_path, format, workers, dpi_text, dpi_md, output_dir, quality, force_ocr, pipeline, preprocess)
     
     # Print summary for folder processing
     if os.path.isdir(input_path) and results:
@@ -0,0 +1,50 @@
+# migrate_vectors.py
+import os
+import sys
+import pickle
+import orjson
+import numpy as np
+
+def migrate_vectors(input_path='vectors.pkl', embeddings_path='embeddings.npy', metadata_path='metadata.json'):
+    """
+    Split a pickled vector database into a float16 embeddings file and a JSON metadata sidecar.
+
+    The embeddings are normalized before the cast so the app can memory-map them and
+    score straight off the page cache without a float32 copy.
+
+    Args:
+        input_path (str): Path to the legacy vector database pickle
+        embeddings_path (str): Path to write the float16 embeddings (.npy)
+        metadata_path (str): Path to write the model name and message metadata
+
+    Returns:
+        bool: True if the migration succeeded
+    """
+    if not os.path.exists(input_path):
+        print(f"Error: Vector database file '{input_path}' not found.")
+        return False
+
+    try:
+        with open(input_path, 'rb') as f:
+            vector_database = pickle.load(f)
+
+        embeddings = np.asarray(vector_database.pop('embeddings'), dtype=np.float32)
+        if embeddings.ndim == 2 and len(embeddings) > 0:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        np.save(embeddings_path, np.ascontiguousarray(embeddings, dtype=np.float16))
+
+        # The model is loaded by name, so it is not carried over
+        vector_database.pop('model', None)
+        with open(metadata_path, 'wb') as f:
+            f.write(orjson.dumps(vector_database, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+
+        print(f"Wrote {len(embeddings)} float16 embeddings to '{embeddings_path}' and metadata to '{metadata_path}'")
+        return True
+    except Exception as e:
+        print(f"Error migrating vector database: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    input_path = sys.argv[1] if len(sys.argv) > 1 else 'vectors.pkl'
+    if not migrate_vectors(input_path):
+        sys.exit(1)
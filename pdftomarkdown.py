@@ -8,9 +8,13 @@ import os
 import sys
 import argparse
 from pathlib import Path
-import pdfplumber
+import fitz  # PyMuPDF, the same engine extractText.py uses
+import pandas as pd
 from markdown_it import MarkdownIt
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from util import iter_files
 
 def pdf_to_markdown(pdf_path):
     """
@@ -25,32 +29,27 @@ def pdf_to_markdown(pdf_path):
     markdown_content = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with fitz.open(pdf_path) as pdf:
             # Process each page
-            for i, page in enumerate(pdf.pages):
-                # Extract text
-                text = page.extract_text()
+            for i, page in enumerate(pdf):
+                # Extract text in reading order
+                text = page.get_text("text", sort=True)
                 if text:
                     # Add page header
                     markdown_content.append(f"## Page {i+1}")
                     markdown_content.append("")
                     
-                    # Process text to improve Markdown formatting
-                    lines = text.split('\n')
-                    processed_lines = []
+                    # Process text to improve Markdown formatting in one vectorized pass per page
+                    lines = pd.Series(text.split('\n')).str.strip()
+                    lengths = lines.str.len()
                     
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-   		   	                    
-                        # Handle headers (detect based on font size and formatting)
-                        if len(line) > 50 and line.isupper():
-                            processed_lines.append(f"# {line}")
-                        elif len(line) > 30 and line.isupper():
-                            processed_lines.append(f"## {line}")
-                        else:
-                            processed_lines.append(line)
+                    # Handle headers (detect based on font size and formatting)
+                    # object dtype runs Python's str.isupper; pandas 3's pyarrow-backed str dtype disagrees on some codepoints
+                    is_upper = lines.astype(object).str.isupper()
+                    h1 = (lengths > 50) & is_upper
+                    h2 = (lengths > 30) & is_upper & ~h1
+                    lines = lines.mask(h1, "# " + lines).mask(h2, "## " + lines)
+                    processed_lines = lines[lengths > 0].tolist()
                     
                     markdown_content.extend(processed_lines)
                     markdown_content.append("")  # Add blank line after page
@@ -85,9 +84,12 @@ def create_markdown_from_pdf(pdf_path, output_dir):
     
     print(f"Converted: {pdf_path} -> {markdown_path}")
 
-def convert_folder():
+def convert_folder(workers=None):
     """
     Convert all PDFs in the 'onenote' folder and its subfolders to Markdown.
+    
+    Args:
+        workers (int): Number of PDFs converted in parallel (defaults to the CPU count; 1 runs serially)
     """
     # Set input and output folders
     input_folder = 'onenote'
@@ -99,11 +101,7 @@ def convert_folder():
         return
     
     # Find all PDF files
-    pdf_files = []
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                pdf_files.append(os.path.join(root, file))
+    pdf_files = sorted(iter_files(input_folder, '.pdf'))
     
     if not pdf_files:
         print("No PDF files found in the 'onenote' folder and subfolders.")
@@ -111,20 +109,37 @@ def convert_folder():
     
     print(f"Found {len(pdf_files)} PDF files to convert.")
     
-    # Convert each PDF
+    workers = workers or os.cpu_count() or 1
     converted_count = 0
-    for pdf_file in pdf_files:
-        try:
-            create_markdown_from_pdf(pdf_file, output_folder)
-            converted_count += 1
-        except Exception as e:
-            print(f"Failed to convert {pdf_file}: {str(e)}")
+    if workers == 1:
+        # Convert each PDF serially (easier to debug)
+        for pdf_file in pdf_files:
+            try:
+                create_markdown_from_pdf(pdf_file, output_folder)
+                converted_count += 1
+            except Exception as e:
+                print(f"Failed to convert {pdf_file}: {str(e)}")
+    else:
+        # Each PDF is independent, so convert them across processes
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(create_markdown_from_pdf, pdf_file, output_folder): pdf_file
+                       for pdf_file in pdf_files}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Converting", unit="pdf"):
+                try:
+                    future.result()
+                    converted_count += 1
+                except Exception as e:
+                    print(f"Failed to convert {futures[future]}: {str(e)}")
     
     print(f"Conversion complete. {converted_count} files converted.")
 
 def main():
     """Main function to run conversion."""
-    convert_folder()
+    parser = argparse.ArgumentParser(description="Convert PDFs in 'onenote' to Markdown.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of PDFs to convert in parallel (default: CPU count, 1 = serial)")
+    args = parser.parse_args()
+    convert_folder(args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,26 +1,36 @@
 # search_vectors.py
 import pickle
+import orjson
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 import os
 
-def load_vector_database(file_path='vectors.pkl'):
+def load_vector_database(file_path='vectors.pkl', embeddings_path='embeddings.npy', metadata_path='metadata.json'):
     """
-    Load the vector database from pickle file.
+    Load the vector database, preferring the split embeddings.npy + metadata.json layout.
     
     Args:
-        file_path (str): Path to the pickle file containing vectors
+        file_path (str): Path to the legacy pickle file containing vectors
+        embeddings_path (str): Path to the embeddings matrix
+        metadata_path (str): Path to the model name and message metadata
     
     Returns:
         dict: Vector database with embeddings, metadata, and model
     """
-    if not os.path.exists(file_path):
+    if os.path.exists(embeddings_path) and os.path.exists(metadata_path):
+        with open(metadata_path, 'rb') as f:
+            vector_database = orjson.loads(f.read())
+        vector_database['embeddings'] = np.load(embeddings_path, mmap_mode='r')
+    elif os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            vector_database = pickle.load(f)
+    else:
         print(f"Error: Vector database file '{file_path}' not found.")
         return None
     
-    with open(file_path, 'rb') as f:
-        vector_database = pickle.load(f)
+    if 'model' not in vector_database:
+        vector_database['model'] = SentenceTransformer(vector_database['model_name'])
     
     print(f"Loaded vector database with {len(vector_database['embeddings'])} embeddings")
     return vector_database
@@ -60,10 +70,13 @@ def search_vectors(query, vector_database, top_k=10):
     results = []
     for idx in top_indices:
         if similarities[idx] > 0:  # Only include results with some similarity
+            metadata = vector_database['message_metadata'][idx]
+            # Older databases keep the text under 'original_message'
+            content = metadata['content'] if 'content' in metadata else metadata['original_message']['content']
             results.append({
                 'score': similarities[idx],
-                'metadata': vector_database['message_metadata'][idx],
-                'content': vector_database['message_metadata'][idx]['original_message']['content']
+                'metadata': metadata,
+                'content': content
             })
     
     return results
@@ -1,128 +1,324 @@
-import json
+import os
 import re
-from pathlib import Path
+import mmap
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+try:
+    # orjson parses the UTF-8 bytes directly in C; optional, stdlib json works the same
+    from orjson import loads
+    LOADS_MEMORYVIEW = True  # orjson parses a memoryview of a mapped file without copying it
+except ImportError:
+    from json import loads
+    LOADS_MEMORYVIEW = False
+try:
+    # Optional C++ CSV writer
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+try:
+    # Optional streaming parser for very large exports; picks its C (yajl2_c) backend when built
+    import ijson
+except ImportError:
+    ijson = None
 from collections import Counter, defaultdict
+import numpy as np
 import pandas as pd
 import emoji
+from util import iter_files
 
 # ========= CONFIG =========
 DATA_FOLDER = "../discord_jsons"
 OUTPUT_FILE = "user_message_counts.csv"
 EMOJI_OUTPUT_FILE = "emoji_statistics.csv"
 CHANNEL_OUTPUT_FILE = "channel_top_posters.csv"
+STREAM_JSON_MIN_BYTES = 256 * 1024 * 1024  # exports at least this big are stream-parsed with ijson (if installed)
+PYARROW_CSV_MIN_ROWS = 100_000  # frames at least this long are written with pyarrow's CSV writer (if installed)
+USE_EMOJI_LIBRARY = False  # match with emoji.emoji_list instead of the compiled regex (slower; for checking)
 # ===========================
 
 
+def _trie_pattern(words):
+    """
+    Build a regex alternation from a trie of the words, so matching tries one branch
+    per character instead of every word, and longer sequences win over their prefixes.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+def _char_class(chars):
+    """Build a regex character class of the chars, merging consecutive codepoints into ranges."""
+    ranges = []
+    for code in sorted(map(ord, chars)):
+        if ranges and code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return "[" + "".join(
+        re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+        for start, end in ranges
+    ) + "]"
+
+
+# Compiled once at import instead of tokenizing every message with emoji.emoji_list.
+# The lookahead rejects positions that can't start an emoji before trying the trie; ASCII
+# starts (keycaps) also need their second character, so plain digits don't enter the trie.
+_ASCII_STARTS = [key[:2] for key in emoji.EMOJI_DATA if key[0].isascii()]
+_EMOJI_RE = re.compile(
+    f"(?={_char_class({key[0] for key in emoji.EMOJI_DATA if not key[0].isascii()})}"
+    f"|{_char_class({start[0] for start in _ASCII_STARTS})}{_char_class({start[1] for start in _ASCII_STARTS})})"
+    + _trie_pattern(emoji.EMOJI_DATA)
+)
+# Cheap first pass: every emoji contains its first non-ASCII character, so text with none
+# of these (in particular pure ASCII text) has no emoji; keycaps like "#\ufe0f\u20e3" start with ASCII
+_EMOJI_PREFILTER = re.compile(_char_class({
+    next(char for char in key if not char.isascii()) for key in emoji.EMOJI_DATA
+}))
+
 def extract_username(content):
     """
     Extract username from:
     "[<date> <time> UTC] <username>: <message>"
     """
-    try:
-        after_bracket = content.split("] ", 1)[1]
-        username = after_bracket.split(":", 1)[0]
-        return username.strip()
-    except Exception:
-        return "UNKNOWN"
+    # Text after the first "] " up to the first ":"; str.partition scans in C without a regex match object
+    _, sep, rest = content.partition("] ")
+    return rest.partition(":")[0].strip() if sep else "UNKNOWN"
 
 
 def extract_emojis(text):
     """Extract all emojis from text"""
-    return emoji.emoji_list(text)
+    if text.isascii() or not _EMOJI_PREFILTER.search(text):
+        return []
+    if USE_EMOJI_LIBRARY:
+        return [match["emoji"] for match in emoji.emoji_list(text)]
+    return _EMOJI_RE.findall(text)
 
 
 def extract_channel_name(path):
     """Extract channel name from file path"""
     # Assuming file names follow pattern like "channel_name.json" or "channel_name_123.json"
-    filename = Path(path).name
-    # Remove .json extension
-    channel_name = filename.replace(".json", "")
-    return channel_name
+    # Remove .json extension (guaranteed by the walk in load_all_messages) by slicing
+    return os.path.basename(path)[:-len(".json")]
+
+
+def iter_messages(path):
+    """Yield the message dicts of one export; large files are stream-parsed so the whole document is never built"""
+    if ijson is not None and os.path.getsize(path) >= STREAM_JSON_MIN_BYTES:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item.messages.item", use_float=True)
+        return
+
+    with open(path, "rb") as f:
+        if LOADS_MEMORYVIEW and os.fstat(f.fileno()).st_size:
+            # Parse straight off the page-cache mapping instead of reading a second copy into a bytes object
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                data = loads(view)
+        else:
+            data = loads(f.read())
+    for block in data:
+        yield from block.get("messages", [])
+
+
+def process_file(path):
+    """
+    Count one channel export; runs in a worker process.
+    
+    Returns:
+        tuple: (channel name, user message counts, emoji counts, emoji users, emojis,
+        message lengths, message count); emoji users and emojis are parallel lists, one entry per emoji use
+    """
+    usernames = []
+    # One string object per distinct username, so counting hashes/compares by identity
+    # (and pickling the results back to the parent memoizes repeats)
+    user_intern = {}
+    emoji_chars = []
+    emoji_users = []
+    message_lengths = array("i")
+    
+    for msg in iter_messages(path):
+        # Exports nearly always carry "content", so index directly and treat a missing key as the rare case
+        try:
+            content = msg["content"]
+        except KeyError:
+            continue
+        if not content:
+            continue
+
+        raw_username = extract_username(content)
+        username = user_intern.setdefault(raw_username, raw_username)
+        usernames.append(username)
+        
+        # Track message length
+        message_lengths.append(len(content))
+        
+        # Extract and count emojis
+        emojis = extract_emojis(content)
+        if emojis:
+            emoji_chars.extend(emojis)
+            emoji_users.extend([username] * len(emojis))
+
+    # Count messages per user in one vectorized pass (sort=False keeps first-seen order for ties)
+    user_message_count = Counter(pd.Series(usernames, dtype=object).value_counts(sort=False).to_dict())
+    # Counting whole lists runs in Counter's C loop instead of a Python += per emoji
+    total_emoji_count = Counter(emoji_chars)
+
+    return extract_channel_name(path), user_message_count, total_emoji_count, emoji_users, emoji_chars, message_lengths, len(usernames)
+
+
+def prefetch_files(paths):
+    """
+    Ask the kernel to start reading every file into the page cache (POSIX_FADV_WILLNEED)
+    so cold-cache reads overlap with parsing instead of each worker waiting on its own read.
+    No-op where posix_fadvise isn't available.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
 
 
 def load_all_messages(folder):
     user_message_count = Counter()
-    user_emoji_count = Counter()
+    # (user, emoji) uses as two flat lists; they're grouped once at export instead of hashing a tuple per use
+    emoji_users = []
+    emoji_chars = []
     total_emoji_count = Counter()
-    message_lengths = []
+    message_lengths = array("i")
     total_messages = 0
     channel_user_counts = defaultdict(Counter)
     
-    for path in Path(folder).rglob("*.json"):
-        channel_name = extract_channel_name(path)
-        
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-            for block in data:
-                for msg in block.get("messages", []):
-                    content = msg.get("content")
-                    if not content:
-                        continue
-
-                    username = extract_username(content)
-                    user_message_count[username] += 1
-                    channel_user_counts[channel_name][username] += 1
-                    total_messages += 1
-                    
-                    # Track message length
-                    message_lengths.append(len(content))
-                    
-                    # Extract and count emojis
-                    emojis = extract_emojis(content)
-                    for emoji_data in emojis:
-                        emoji_char = emoji_data['emoji']
-                        total_emoji_count[emoji_char] += 1
-                        user_emoji_count[(username, emoji_char)] += 1
-
-    return user_message_count, total_emoji_count, user_emoji_count, message_lengths, total_messages, channel_user_counts
-
-
-def export_user_stats(counter, output_file):
-    df = pd.DataFrame(counter.items(), columns=["Username", "Message Count"])
-    df = df.sort_values(by="Message Count", ascending=False)
-    df.to_csv(output_file, index=False)
-
-
-def export_emoji_stats(total_emoji_count, user_emoji_count, output_file):
+    # Files are independent, so count them in parallel and merge the per-file counters in file order
+    # Plain str paths from a scandir walk (file types come from the listing, no Path objects)
+    paths = list(iter_files(folder, ".json"))
+    prefetch = threading.Thread(target=prefetch_files, args=(paths,), daemon=True)
+    if len(paths) < 2:
+        prefetch.start()
+        results = [process_file(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # map submits every task up front, which starts the workers; only then start the
+            # prefetch thread, so no worker is forked while another thread is running
+            pending = executor.map(process_file, paths, chunksize=8)
+            prefetch.start()
+            results = list(pending)
+
+    for channel_name, users, emojis, file_emoji_users, file_emoji_chars, lengths, count in results:
+        user_message_count.update(users)
+        if users:
+            # Exports without messages don't count as channels
+            channel_user_counts[channel_name].update(users)
+        total_emoji_count.update(emojis)
+        emoji_users.extend(file_emoji_users)
+        emoji_chars.extend(file_emoji_chars)
+        message_lengths.extend(lengths)
+        total_messages += count
+
+    return user_message_count, total_emoji_count, (emoji_users, emoji_chars), message_lengths, total_messages, channel_user_counts
+
+
+def write_csv(df, output_file):
+    """Write a DataFrame as CSV without its index; only very long frames go through pyarrow's multithreaded writer"""
+    # pyarrow writes 2.0 as "2", so float frames (the one-row summary) stay on pandas
+    if (pa is None or len(df) < PYARROW_CSV_MIN_ROWS or df.columns.empty
+            or any(pd.api.types.is_float_dtype(dtype) for dtype in df.dtypes)):
+        df.to_csv(output_file, index=False)
+        return
+    try:
+        # Unquoted (header included), matching pandas output for values without delimiters or quotes
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with open(output_file, "wb") as f:
+            f.write((",".join(map(str, df.columns)) + "\n").encode("utf-8"))
+            pacsv.write_csv(table, f, write_options=pacsv.WriteOptions(include_header=False, quoting_style="none"))
+    except (pa.ArrowInvalid, TypeError):
+        # A value needs quoting (pyarrow would quote every string), or this pyarrow has no quoting_style,
+        # so let pandas write the file
+        df.to_csv(output_file, index=False)
+
+
+def sort_counts(counter):
+    """
+    Sort a Counter into a Series once, so every export slices it instead of re-sorting.
+    
+    Args:
+        counter (Counter): Counts keyed by username or emoji
+    
+    Returns:
+        pd.Series: Counts, highest first (stable, so ties keep first-seen order like most_common)
+    """
+    return pd.Series(counter, dtype="int64").sort_values(ascending=False, kind="stable")
+
+
+def export_user_stats(user_series, output_file):
+    df = user_series.rename_axis("Username").reset_index(name="Message Count")
+    write_csv(df, output_file)
+
+
+def export_emoji_stats(emoji_series, user_emojis, output_file):
     # Top emojis
-    top_emojis = total_emoji_count.most_common(50)
-    emoji_df = pd.DataFrame(top_emojis, columns=["Emoji", "Count"])
-    emoji_df.to_csv(output_file, index=False)
+    emoji_df = emoji_series.head(50).rename_axis("Emoji").reset_index(name="Count")
+    write_csv(emoji_df, output_file)
     
     # User emoji stats
-    user_emoji_df = pd.DataFrame([
-        {"Username": user, "Emoji": emoji, "Count": count} 
-        for (user, emoji), count in user_emoji_count.most_common()
-    ])
-    user_emoji_df.to_csv("user_emoji_stats.csv", index=False)
+    # (user, emoji) pairs counted by groupby in first-seen order, then a stable sort like most_common
+    emoji_users, emoji_chars = user_emojis
+    if emoji_users:
+        user_emoji_df = (
+            pd.DataFrame({"Username": emoji_users, "Emoji": emoji_chars}, dtype=object)
+            .groupby(["Username", "Emoji"], sort=False)
+            .size()
+            .sort_values(ascending=False, kind="stable")
+            .reset_index(name="Count")
+        )
+    else:
+        user_emoji_df = pd.DataFrame([])
+    write_csv(user_emoji_df, "user_emoji_stats.csv")
 
 
 def export_channel_top_posters(channel_user_counts, output_file):
     """Export the top poster for each channel"""
-    channel_top_posters = []
+    rows = []
     
     for channel, user_counts in channel_user_counts.items():
         if user_counts:
-            top_poster = user_counts.most_common(1)[0][0]
-            top_poster_count = user_counts.most_common(1)[0][1]
-            channel_top_posters.append({
-                "Channel": channel,
-                "Top Poster": top_poster,
-                "Message Count": top_poster_count
-            })
+            (top_poster, top_poster_count), = user_counts.most_common(1)
+            rows.append((channel, top_poster, top_poster_count))
     
-    # Sort by message count descending
-    channel_top_posters.sort(key=lambda x: x["Message Count"], reverse=True)
-    df = pd.DataFrame(channel_top_posters)
-    df.to_csv(output_file, index=False)
+    # Sort by message count descending (stable, so tied channels keep their order)
+    df = pd.DataFrame(rows, columns=["Channel", "Top Poster", "Message Count"])
+    df = df.sort_values(by="Message Count", ascending=False, kind="stable")
+    write_csv(df, output_file)
 
 
-def export_statistics(user_message_count, total_emoji_count, message_lengths, total_messages, channel_user_counts):
+def export_statistics(user_series, emoji_series, message_lengths, total_messages, channel_user_counts):
     # Calculate statistics
-    avg_message_length = sum(message_lengths) / len(message_lengths) if message_lengths else 0
-    total_unique_users = len(user_message_count)
-    total_unique_emojis = len(total_emoji_count)
+    # Lengths are a C int array, so take the mean without boxing every element
+    avg_message_length = float(np.frombuffer(message_lengths, dtype=np.intc).mean()) if len(message_lengths) else 0
+    total_unique_users = len(user_series)
+    total_unique_emojis = len(emoji_series)
     total_channels = len(channel_user_counts)
     
     stats = {
@@ -134,17 +330,15 @@ def export_statistics(user_message_count, total_emoji_count, message_lengths, to
     }
     
     stats_df = pd.DataFrame(stats)
-    stats_df.to_csv("statistics_summary.csv", index=False)
+    write_csv(stats_df, "statistics_summary.csv")
     
     # Top 10 users by message count
-    top_users = user_message_count.most_common(10)
-    top_users_df = pd.DataFrame(top_users, columns=["Username", "Message Count"])
-    top_users_df.to_csv("top_users.csv", index=False)
+    top_users_df = user_series.head(10).rename_axis("Username").reset_index(name="Message Count")
+    write_csv(top_users_df, "top_users.csv")
     
     # Top 20 emojis
-    top_emojis = total_emoji_count.most_common(20)
-    top_emojis_df = pd.DataFrame(top_emojis, columns=["Emoji", "Count"])
-    top_emojis_df.to_csv("top_emojis.csv", index=False)
+    top_emojis_df = emoji_series.head(20).rename_axis("Emoji").reset_index(name="Count")
+    write_csv(top_emojis_df, "top_emojis.csv")
 
 
 def main():
@@ -154,10 +348,14 @@ def main():
     print(f"Found {total_messages} total messages.")
     print("Exporting CSV files...")
 
-    export_user_stats(user_counts, OUTPUT_FILE)
-    export_emoji_stats(total_emojis, user_emojis, EMOJI_OUTPUT_FILE)
+    # Sorted once here; the full and top-N exports are slices of the same Series
+    user_series = sort_counts(user_counts)
+    emoji_series = sort_counts(total_emojis)
+
+    export_user_stats(user_series, OUTPUT_FILE)
+    export_emoji_stats(emoji_series, user_emojis, EMOJI_OUTPUT_FILE)
     export_channel_top_posters(channel_user_counts, CHANNEL_OUTPUT_FILE)
-    export_statistics(user_counts, total_emojis, message_lengths, total_messages, channel_user_counts)
+    export_statistics(user_series, emoji_series, message_lengths, total_messages, channel_user_counts)
 
     print(f"Done. Files saved as:")
     print(f"- {OUTPUT_FILE}")
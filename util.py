@@ -0,0 +1,122 @@
+# util.py
+"""
+Shared helpers for the chunking and vectorization scripts
+"""
+
+import os
+import blake3
+import orjson
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+def get_file_hash(filepath, buffer_size=1 << 20):
+    """Calculate a BLAKE3 hash of a file's content, tagged "b3:" so older MD5 cache entries miss."""
+    hasher = blake3.blake3()
+    try:
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= buffer_size:
+                hasher.update(f.read())
+            else:
+                # Reuse one buffer for every read instead of allocating a bytes object per chunk
+                buffer = bytearray(buffer_size)
+                view = memoryview(buffer)
+                while (n := f.readinto(buffer)):
+                    hasher.update(view[:n])
+        return "b3:" + hasher.hexdigest()
+    except Exception as e:
+        print(f"Error calculating hash for {filepath}: {e}")
+        return None
+
+def get_file_hashes(filepaths):
+    """
+    Hash many files in parallel across processes.
+    
+    Args:
+        filepaths (list): Paths of the files to hash
+    
+    Returns:
+        dict: Path -> hash (None where hashing failed)
+    """
+    if len(filepaths) < 2:
+        return {filepath: get_file_hash(filepath) for filepath in filepaths}
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return dict(zip(filepaths, executor.map(get_file_hash, filepaths, chunksize=16)))
+
+def iter_files(root, suffix):
+    """
+    Recursively yield the paths of files under root whose name ends with suffix (case-insensitive).
+    
+    Uses os.scandir so file types come from the directory listing instead of one stat per entry.
+    Like Path.rglob, a directory's own files come before anything in its subdirectories,
+    and a missing root yields nothing.
+    
+    Args:
+        root (str): Directory to walk
+        suffix (str): Lowercase filename suffix to match, e.g. '.pdf'
+    
+    Yields:
+        str: Path of each matching file
+    """
+    subdirs = []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(suffix):
+                    yield entry.path
+    except FileNotFoundError:
+        return
+    for subdir in subdirs:
+        yield from iter_files(subdir, suffix)
+
+def load_cache(cache_file):
+    """
+    Load a JSON cache file.
+    
+    Args:
+        cache_file (str): Path to the cache file
+    
+    Returns:
+        dict: Cached entries (empty if the file is missing or unreadable)
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception as e:
+        print(f"Warning: Could not load cache '{cache_file}': {e}")
+        return {}
+
+def save_cache(cache, cache_file):
+    """
+    Save a cache dictionary as indented JSON.
+    
+    Args:
+        cache (dict): Cached entries
+        cache_file (str): Path to the cache file
+    """
+    try:
+        with open(cache_file, 'wb') as f:
+            f.write(orjson.dumps(cache, option=orjson.OPT_INDENT_2))
+    except Exception as e:
+        print(f"Warning: Could not save cache '{cache_file}': {e}")
+
+def quantize_int8(vectors):
+    """
+    Symmetrically quantize row vectors to int8 with one scale per row: q = round(v / scale), scale = max|v| / 127.
+    
+    Shared by create_vectors.py (which saves the int8 files) and app.py (which quantizes at load),
+    so both produce the same vectors.
+    
+    Args:
+        vectors (np.ndarray): 2D float array of row vectors
+    
+    Returns:
+        tuple: (int8 vectors, float32 per-row scales)
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales